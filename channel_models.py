@@ -0,0 +1,279 @@
+import heapq
+import itertools
+from collections import deque
+
+try:
+    import numpy
+except ImportError:                                     # numpy is only needed for BatchChannel
+    numpy = None
+
+import rdt_events
+from channel_trace import DROP
+from segment import Segment
+from unreliable import UnreliableChannel
+
+
+# #################################################################################################################### #
+# Channel models                                                                                                       #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Alternative channels with the same send()/receive()/processData() interface and counters as UnreliableChannel, so    #
+# they can be used anywhere it is. Each model only changes one aspect of the channel; they cooperate through super()   #
+# and can be combined, e.g.                                                                                            #
+#                                                                                                                      #
+#   class BurstyBottleneck(GilbertElliottChannel, CapacityChannel): pass                                               #
+#                                                                                                                      #
+# Model options are keyword arguments, everything else is passed on to UnreliableChannel.                              #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+def constantDelay(iterations):
+    """
+    Propagation delay of exactly iterations
+    """
+    return lambda rng: iterations
+
+
+def uniformDelay(low, high):
+    """
+    Propagation delay uniformly distributed between low and high iterations (inclusive)
+    """
+    return lambda rng: rng.randint(low, high)
+
+
+def exponentialDelay(mean):
+    """
+    Propagation delay exponentially distributed around mean iterations
+    """
+    return lambda rng: int(round(rng.expovariate(1.0 / mean)))
+
+
+def wireLength(seg):
+    """
+    Size of a segment on the wire (see Segment.pack), without encoding it
+    """
+    payload = seg.payload
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8', 'surrogatepass')
+    return Segment.WIRE_HEADER.size + Segment.CHECKSUM_HEADER.size * len(seg.sackBlocks) + len(payload)
+
+
+class GilbertElliottChannel(UnreliableChannel):
+    """
+    Burst losses: whether a packet is dropped depends on a two-state Markov chain stepped once per packet, with
+    a low loss rate in the good state and a high one in the bad state. Applies when the channel can drop packets.
+    The defaults lose RATIO_DROPPED_PACKETS of the packets on average, in bursts of about four.
+    """
+    GOOD_TO_BAD = 0.05                                  # Chance of moving to the bad state, per packet
+    BAD_TO_GOOD = 0.25                                  # Chance of moving back to the good state, per packet
+    LOSS_GOOD = 0.0                                     # Loss rate in the good state
+    LOSS_BAD = 0.6                                      # Loss rate in the bad state
+
+    def __init__(self, *args, goodToBad=None, badToGood=None, lossGood=None, lossBad=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.goodToBad = GilbertElliottChannel.GOOD_TO_BAD if goodToBad is None else goodToBad
+        self.badToGood = GilbertElliottChannel.BAD_TO_GOOD if badToGood is None else badToGood
+        self.lossGood = GilbertElliottChannel.LOSS_GOOD if lossGood is None else lossGood
+        self.lossBad = GilbertElliottChannel.LOSS_BAD if lossBad is None else lossBad
+        self.inBadState = False
+        self.countBadStatePackets = 0
+
+    def decide(self, kind, ratio):
+        if kind == DROP:
+            # A replayed trace already holds the outcome, the chain is not needed until it runs out
+            if self.replay is None or self.replay.isExhausted(DROP):
+                if self.random.random() < (self.badToGood if self.inBadState else self.goodToBad):
+                    self.inBadState = not self.inBadState
+            if self.inBadState:
+                self.countBadStatePackets += 1
+            ratio = self.lossBad if self.inBadState else self.lossGood
+        return super().decide(kind, ratio)
+
+
+class CapacityChannel(UnreliableChannel):
+    """
+    Bottleneck link: at most segmentsPerIteration segments (and bytesPerIteration bytes on the wire, when set) leave
+    a FIFO queue each iteration. Segments sent while queueLimit segments are already waiting are dropped (tail drop).
+    """
+    SEGMENTS_PER_ITERATION = 8
+    BYTES_PER_ITERATION = None
+    QUEUE_LIMIT = 32
+
+    def __init__(self, *args, segmentsPerIteration=None, bytesPerIteration=None, queueLimit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.segmentsPerIteration = (CapacityChannel.SEGMENTS_PER_ITERATION if segmentsPerIteration is None
+                                     else segmentsPerIteration)
+        self.bytesPerIteration = CapacityChannel.BYTES_PER_ITERATION if bytesPerIteration is None else bytesPerIteration
+        self.queueLimit = CapacityChannel.QUEUE_LIMIT if queueLimit is None else queueLimit
+        self.bottleneckQueue = deque()
+        self.countTailDrops = 0
+        self.maxQueueLength = 0
+
+    def getMetrics(self):
+        metrics = super().getMetrics()
+        metrics['bottleneckPackets'] = len(self.bottleneckQueue)
+        metrics['tailDrops'] = self.countTailDrops
+        return metrics
+
+    def send(self, seg):
+        if len(self.bottleneckQueue) >= self.queueLimit:
+            self.countTailDrops += 1
+            self.countDroppedPackets += 1
+            if self.tracer is not None:
+                self.tracer.emitSegment(rdt_events.DROP, self.currentIteration, seg)
+            if seg.seqnum != -1:
+                self.countTotalDataPackets += 1
+            else:
+                self.countAckPackets += 1
+            return
+
+        self.bottleneckQueue.append(seg)
+        self.maxQueueLength = max(self.maxQueueLength, len(self.bottleneckQueue))
+
+    def processData(self):
+        # Move what the link can carry this iteration on to the impairments, at least one segment
+        segments = 0
+        sentBytes = 0
+        while self.bottleneckQueue and segments < self.segmentsPerIteration:
+            if self.bytesPerIteration is not None:
+                size = wireLength(self.bottleneckQueue[0])
+                if segments and sentBytes + size > self.bytesPerIteration:
+                    break
+                sentBytes += size
+            super().send(self.bottleneckQueue.popleft())
+            segments += 1
+
+        super().processData()
+
+
+class PropagationDelayChannel(UnreliableChannel):
+    """
+    Every segment that makes it through the channel arrives after a propagation delay drawn from delay, a function
+    of the channel's random generator returning iterations (see constantDelay, uniformDelay, exponentialDelay).
+    Varying delays reorder segments. The delays are not part of recorded traces.
+    """
+    PROPAGATION_DELAY = 2
+
+    def __init__(self, *args, delay=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = constantDelay(PropagationDelayChannel.PROPAGATION_DELAY) if delay is None else delay
+        self.inFlight = []                              # Heap of (arrival iteration, order sent, segment)
+        self.flightOrder = itertools.count()
+
+    def getMetrics(self):
+        metrics = super().getMetrics()
+        metrics['inFlightPackets'] = len(self.inFlight)
+        return metrics
+
+    def deliver(self, seg):
+        arrival = self.currentIteration + self.delay(self.random)
+        heapq.heappush(self.inFlight, (arrival, next(self.flightOrder), seg))
+
+    def deliverMany(self, segments):
+        for seg in segments:
+            self.deliver(seg)
+
+    def processData(self):
+        super().processData()
+
+        # Arrivals do not depend on anything being sent this iteration
+        while self.inFlight and self.inFlight[0][0] <= self.currentIteration:
+            self.receiveQueue.append(heapq.heappop(self.inFlight)[2])
+
+
+class BatchChannel(UnreliableChannel):
+    """
+    Draws every impairment decision of an iteration in a single numpy call and classifies the segments with array
+    operations, with the same RATIO_* semantics as UnreliableChannel. The draws come from a numpy generator, so runs
+    differ from UnreliableChannel runs with the same seed. Decisions are made here rather than through decide(), so
+    models that override it (GilbertElliottChannel) do not apply; with a trace recorder or replay every decision
+    goes through decide() one at a time as in UnreliableChannel. Needs numpy.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if numpy is None:
+            raise ImportError('BatchChannel needs numpy')
+        super().__init__(*args, **kwargs)
+        self.generator = numpy.random.default_rng(self.seed)
+
+    def processData(self):
+        if self.recorder is not None or self.replay is not None:
+            return super().processData()
+
+        self.currentIteration += 1
+
+        if len(self.sendQueue) == 0:
+            return
+
+        sendQueue, self.sendQueue = self.sendQueue, []
+        count = len(sendQueue)
+
+        # One draw for reordering, then a delay, drop and corruption draw per segment
+        draws = self.generator.random(1 + 3 * count)
+        delayDraws, dropDraws, errorDraws = draws[1:].reshape(3, count)
+
+        if self.canDeliverOutOfOrder and draws[0] <= UnreliableChannel.RATIO_OUT_OF_ORDER_PACKETS:
+            self.countOutOfOrderPackets += 1
+            sendQueue.reverse()
+
+        while self.delayedPackets and self.delayedPackets[0][0] <= self.currentIteration:
+            seg = heapq.heappop(self.delayedPackets)[2]
+            self.countSentPackets += 1
+            self.deliver(seg)
+
+        isData = numpy.array([seg.seqnum for seg in sendQueue]) != -1
+        delayed = (delayDraws <= UnreliableChannel.RATIO_DELAYED_PACKETS) & self.canDelayPackets
+        passed = ~delayed
+        dropped = passed & (dropDraws <= UnreliableChannel.RATIO_DROPPED_PACKETS) & self.canDropPackets
+        delivered = passed & ~dropped
+
+        # As in UnreliableChannel, only data segments are corrupted, dropped ones included
+        corrupted = passed & isData & (errorDraws <= UnreliableChannel.RATIO_DATA_ERROR_PACKETS) & self.canHaveChecksumErrors
+
+        countPassed = int(passed.sum())
+        countDelivered = int(delivered.sum())
+        countPassedData = int((passed & isData).sum())
+        self.countDelayedPackets += count - countPassed
+        self.countDroppedPackets += countPassed - countDelivered
+        self.countSentPackets += countDelivered
+        self.countTotalDataPackets += countPassedData
+        self.countAckPackets += countPassed - countPassedData
+
+        # Only the delayed, dropped (when traced) and corrupted segments are visited one by one
+        self.deliverMany(itertools.compress(sendQueue, delivered.tolist()))
+
+        delayedIndices = numpy.flatnonzero(delayed).tolist()
+        if delayedIndices:
+            releaseIteration = self.currentIteration + UnreliableChannel.ITERATIONS_TO_DELAY_PACKETS
+            for i in delayedIndices:
+                seg = sendQueue[i]
+                seg.setStartDelayIteration(self.currentIteration)
+                heapq.heappush(self.delayedPackets, (releaseIteration, next(self.delayOrder), seg))
+                if self.tracer is not None:
+                    self.tracer.emitSegment(rdt_events.DELAY, self.currentIteration, seg)
+
+        if self.tracer is not None:
+            for i in numpy.flatnonzero(dropped).tolist():
+                self.tracer.emitSegment(rdt_events.DROP, self.currentIteration, sendQueue[i])
+
+        corruptedIndices = numpy.flatnonzero(corrupted).tolist()
+        if corruptedIndices:
+            self.countChecksumErrorPackets += len(corruptedIndices)
+            # Position of the corrupted byte as a fraction of the payload length
+            positions = self.generator.random(len(corruptedIndices)).tolist()
+            for i, position in zip(corruptedIndices, positions):
+                seg = sendQueue[i]
+                if seg.payload:
+                    seg.createChecksumError(int(position * len(seg.payload)))
+                if self.tracer is not None:
+                    self.tracer.emitSegment(rdt_events.CORRUPT, self.currentIteration, seg)
+
+
+CHANNEL_MODELS = {
+    'unreliable': UnreliableChannel,
+    'gilbert-elliott': GilbertElliottChannel,
+    'capacity': CapacityChannel,
+    'propagation': PropagationDelayChannel,
+    'batch': BatchChannel,
+}
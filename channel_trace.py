@@ -0,0 +1,166 @@
+import struct
+
+
+# #################################################################################################################### #
+# Channel traces                                                                                                       #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Records every impairment decision of a pair of UnreliableChannels (reorder, delay, drop, corrupt) to a compact       #
+# binary file, and replays such a file so a later run sees the same impairments without drawing random numbers.        #
+# Each channel gets its own view of the recorder or replay (recorder.channel('toServer')), and the decisions are kept  #
+# in one stream per channel and kind. A replayed run that makes a different number of decisions of some kind (another  #
+# MSS or window, other protocol options) still applies the recorded ones in order, and once a stream runs out the      #
+# channel draws from its random generator again.                                                                       #
+#                                                                                                                      #
+# Format:                                                                                                              #
+# The MAGIC header followed by the streams. Each one is a STREAM header (length of the channel name, kind, number of   #
+# decisions), the channel name in UTF-8 and the decisions: one byte each (1 hit, 0 miss), except corrupt decisions,    #
+# which are the index of the corrupted payload byte as a 4 byte signed integer, -1 when the segment was not corrupted. #
+# All integers are in network byte order.                                                                              #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+MAGIC = b'RDTT\x02'
+
+REORDER = 0
+DELAY = 1
+DROP = 2
+CORRUPT = 3
+
+KIND_NAMES = ('reorder', 'delay', 'drop', 'corrupt')
+
+STREAM = struct.Struct('!HBI')
+INDEX = struct.Struct('!i')
+
+
+class TraceRecorder(object):
+    """
+    Collects the decisions of the channels it is handed to through channel() and writes them to a trace file when
+    closed
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.streams = {}                               # Decisions by (channel name, kind), indices for CORRUPT
+        self.countDecisions = 0
+
+    def channel(self, name):
+        """
+        The recorder to give the channel called name
+        """
+        return ChannelRecorder(self, name)
+
+    def close(self):
+        with open(self.path, 'wb') as f:
+            f.write(MAGIC)
+            for (name, kind), decisions in self.streams.items():
+                encoded = name.encode('utf-8')
+                f.write(STREAM.pack(len(encoded), kind, len(decisions)))
+                f.write(encoded)
+                if kind == CORRUPT:
+                    f.write(b''.join(map(INDEX.pack, decisions)))
+                else:
+                    f.write(decisions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ChannelRecorder(object):
+    """
+    Records the decisions of one channel into a TraceRecorder
+    """
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def record(self, kind, hit, index=None):
+        """
+        Records a decision, for CORRUPT the index of the corrupted byte when it hit
+        """
+        streams = self.recorder.streams
+        key = (self.name, kind)
+        if key not in streams:
+            streams[key] = [] if kind == CORRUPT else bytearray()
+        streams[key].append((index if hit else -1) if kind == CORRUPT else hit)
+        self.recorder.countDecisions += 1
+
+
+class TraceReplay(object):
+    """
+    Reads a trace file, the decisions are handed out by the views channel() returns
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError('%s is not a channel trace' % path)
+
+        self.streams = {}
+        position = len(MAGIC)
+        while position < len(data):
+            nameLength, kind, count = STREAM.unpack_from(data, position)
+            position += STREAM.size
+            name = data[position:position + nameLength].decode('utf-8')
+            position += nameLength
+            if kind == CORRUPT:
+                self.streams[(name, kind)] = [index for index, in INDEX.iter_unpack(
+                    data[position:position + count * INDEX.size])]
+                position += count * INDEX.size
+            else:
+                self.streams[(name, kind)] = data[position:position + count]
+                position += count
+
+    def channel(self, name):
+        """
+        The replay to give the channel called name
+        """
+        return ChannelReplay(self, name)
+
+
+class ChannelReplay(object):
+    """
+    Hands out the recorded decisions of one channel, each kind in the order it was recorded
+    """
+
+    def __init__(self, replay, name):
+        self.streams = [replay.streams.get((name, kind), b'') for kind in range(len(KIND_NAMES))]
+        self.positions = [0] * len(KIND_NAMES)
+        self.countDecisions = 0                         # Decisions taken from the trace
+        self.countMissing = 0                           # Decisions asked for after their stream ran out
+
+    def take(self, kind):
+        position = self.positions[kind]
+        if position >= len(self.streams[kind]):
+            self.countMissing += 1
+            return None
+        self.positions[kind] = position + 1
+        self.countDecisions += 1
+        return self.streams[kind][position]
+
+    def next(self, kind):
+        """
+        Whether the next recorded decision of kind hit, None when the trace holds no more of them
+        """
+        value = self.take(kind)
+        return None if value is None else bool(value)
+
+    def nextCorruption(self):
+        """
+        Index of the payload byte the next recorded corrupt decision corrupted, -1 when it missed, None when the
+        trace holds no more of them
+        """
+        return self.take(CORRUPT)
+
+    def isExhausted(self, kind=None):
+        """
+        Whether every recorded decision of kind (of any kind when None) has been handed out
+        """
+        kinds = range(len(KIND_NAMES)) if kind is None else (kind,)
+        return all(self.positions[k] >= len(self.streams[k]) for k in kinds)
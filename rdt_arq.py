@@ -0,0 +1,263 @@
+from rdt_events import ACK, RETRANSMIT, SEND
+from segment import Segment
+
+
+# #################################################################################################################### #
+# ARQ strategies                                                                                                       #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Classic automatic repeat request schemes that can take over the sender and receiver logic of an RDTLayer:            #
+#                                                                                                                      #
+#   layer.setArqStrategy(SelectiveRepeat())                                                                            #
+#                                                                                                                      #
+# The layer keeps its channels, its setDataToSend / getDataReceived API, its receive buffer and delivery, its          #
+# counters and its tracer; the strategy decides what is sent, when it is retransmitted and how it is acknowledged.     #
+# Without a strategy the layer runs its built-in logic (cumulative acks with timeout reports, optionally selective     #
+# acks, an RTT based timer, fast retransmit and congestion control).                                                   #
+#                                                                                                                      #
+# Sequence numbers are byte numbers starting at 1 as in RDTLayer. Windows are in bytes of data in flight,              #
+# flowControlWinSize of the layer unless set in segments. Retransmission timers are fixed, in iterations.              #
+# Both directions can carry data at once; acks are always sent as separate segments.                                   #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+class ArqStrategy(object):
+    """
+    Base of the strategies: processSend() and processReceive() replace the layer's processSend() and
+    processReceiveAndSendRespond(). Subclasses implement sendSegments(), onAck() and onData().
+    A strategy instance holds the state of one layer.
+    """
+    TIMEOUT = 3 # in iterations                         # Default retransmission timeout
+
+    def __init__(self, windowSegments=None, timeout=None):
+        self.windowSegments = windowSegments            # Window in segments, None for the layer's flowControlWinSize
+        self.timeout = ArqStrategy.TIMEOUT if timeout is None else timeout
+        self.layer = None
+        self.base = 1                                   # Oldest unacknowledged sequence number
+        self.nextSeq = 1                                # Sequence number of the next segment to send
+        self.highestSent = 1                            # End of the data sent so far, anything below is a retransmission
+
+    def attach(self, layer):
+        self.layer = layer
+
+    def window(self):
+        """
+        Bytes that may be in flight, at least one segment
+        """
+        layer = self.layer
+        if self.windowSegments is not None:
+            return self.windowSegments * layer.dataLength
+        return max(layer.flowControlWinSize, layer.dataLength)
+
+    def processSend(self):
+        layer = self.layer
+
+        # there is no data to send
+        if layer.sendBuffer is None or layer.sendBuffer.isEnd(0):
+            layer.isServer = True
+            return
+
+        layer.currentSendWindow = self.window()
+        self.sendSegments()
+
+    def processReceive(self):
+        layer = self.layer
+
+        # Corrupted segments are discarded, data and acks are handled separately
+        segments = [i for i in layer.receiveChannel.receive() if i.checkChecksum()]
+
+        for i in sorted((i for i in segments if i.seqnum != -1), key=lambda x: x.seqnum):
+            self.onData(i)
+
+        for i in segments:
+            if i.seqnum == -1 and i.acknum != -1:
+                layer.lastAckReceived = i.acknum
+                layer.countAcksReceived += 1
+                self.onAck(i)
+
+    def sendSegments(self):
+        raise NotImplementedError
+
+    def onAck(self, segment):
+        raise NotImplementedError
+
+    def onData(self, segment):
+        raise NotImplementedError
+
+    def segmentEnd(self, seqnum):
+        """
+        Sequence number just past the segment starting at seqnum, None while no such segment is available (the end
+        of the data, or a streaming source holding less than a full segment)
+        """
+        layer = self.layer
+        lowerBound = seqnum - 1
+        upperBound = layer.sendBuffer.fill(lowerBound + layer.dataLength)
+        if upperBound == lowerBound or (upperBound - lowerBound < layer.dataLength
+                                        and not layer.sendBuffer.isEnd(upperBound)):
+            return None
+        return upperBound + 1
+
+    def transmit(self, seqnum, end):
+        """
+        Sends the data from seqnum to end (exclusive)
+        """
+        layer = self.layer
+        data = layer.sendBuffer.view(seqnum - 1, end - 1)
+
+        segment = Segment()
+        segment.connectionId = layer.connectionId
+        segment.setData(seqnum, data)
+
+        retransmission = seqnum < self.highestSent
+        if retransmission:
+            layer.countRetransmittedSegments += 1
+        else:
+            layer.countSegmentsSent += 1
+            self.highestSent = end
+            layer.sentData = layer.seqCount = end - 1
+        layer.countBytesSent += len(data)
+        if layer.tracer is not None:
+            layer.tracer.emitSegment(RETRANSMIT if retransmission else SEND, layer.currentIteration, segment)
+
+        layer.sendChannel.send(segment)
+
+    def acknowledge(self, base):
+        """
+        Everything below base has been acknowledged, its data is not needed any more
+        """
+        self.base = base
+        self.layer.sendBase = base
+        self.layer.sendBuffer.release(base - 1)
+
+    def sendAck(self, acknum, sackBlocks=()):
+        layer = self.layer
+        segment = Segment()
+        segment.connectionId = layer.connectionId
+        segment.setAck(acknum, sackBlocks)
+        layer.countAcksSent += 1
+        if layer.tracer is not None:
+            layer.tracer.emitSegment(ACK, layer.currentIteration, segment)
+        layer.sendChannel.send(segment)
+
+    def timedOut(self, sentIteration):
+        return self.layer.currentIteration - sentIteration >= self.timeout
+
+
+class GoBackN(ArqStrategy):
+    """
+    One timer for the oldest unacknowledged segment; when it expires, everything from there on is sent again.
+    The receiver only accepts the next segment in order and acknowledges every segment with its cumulative ack.
+    """
+
+    def __init__(self, windowSegments=None, timeout=None):
+        super().__init__(windowSegments, timeout)
+        self.timerStart = None                          # Iteration the timer was started, None when stopped
+
+    def sendSegments(self):
+        layer = self.layer
+
+        # Go back to the oldest unacknowledged segment
+        if self.timerStart is not None and self.timedOut(self.timerStart):
+            layer.countSegmentTimeouts += 1
+            self.nextSeq = self.base
+            self.timerStart = None
+
+        window = self.window()
+        while True:
+            end = self.segmentEnd(self.nextSeq)
+            if end is None or end - self.base > window:
+                break
+            self.transmit(self.nextSeq, end)
+            if self.timerStart is None:
+                self.timerStart = layer.currentIteration
+            self.nextSeq = end
+
+    def onAck(self, segment):
+        if segment.acknum <= self.base:
+            return
+
+        self.acknowledge(segment.acknum)
+        self.nextSeq = max(self.nextSeq, self.base)
+
+        # Restart the timer for the segments still outstanding
+        self.timerStart = self.layer.currentIteration if self.base < self.highestSent else None
+
+    def onData(self, segment):
+        layer = self.layer
+        if segment.seqnum == layer.ackCount:
+            layer.deliverInOrder(segment.payload)
+        self.sendAck(layer.ackCount)
+
+
+class StopAndWait(GoBackN):
+    """
+    Go-Back-N with a window of one segment: every segment waits for its ack before the next one is sent
+    """
+
+    def __init__(self, timeout=None):
+        super().__init__(1, timeout)
+
+
+class SelectiveRepeat(ArqStrategy):
+    """
+    A timer per segment, only segments whose own timer expires are sent again. The receiver buffers segments within
+    its window and acknowledges each one individually: the cumulative ack plus a sack block for that segment.
+    """
+
+    def __init__(self, windowSegments=None, timeout=None):
+        super().__init__(windowSegments, timeout)
+        self.unacked = {}                               # End and iteration last sent of unacknowledged segments, by sequence number
+
+    def sendSegments(self):
+        layer = self.layer
+
+        # Values are replaced in place, the dict stays in sequence number order
+        for seqnum, (end, sentIteration) in self.unacked.items():
+            if self.timedOut(sentIteration):
+                layer.countSegmentTimeouts += 1
+                self.transmit(seqnum, end)
+                self.unacked[seqnum] = (end, layer.currentIteration)
+
+        window = self.window()
+        while True:
+            end = self.segmentEnd(self.nextSeq)
+            if end is None or end - self.base > window:
+                break
+            self.transmit(self.nextSeq, end)
+            self.unacked[self.nextSeq] = (end, layer.currentIteration)
+            self.nextSeq = end
+
+    def onAck(self, segment):
+        unacked = self.unacked
+        while unacked and next(iter(unacked)) < segment.acknum:
+            del unacked[next(iter(unacked))]
+        for start, end in segment.sackBlocks:
+            for seqnum in range(start, end, self.layer.dataLength):
+                unacked.pop(seqnum, None)
+
+        base = next(iter(unacked)) if unacked else self.nextSeq
+        if base > self.base:
+            self.acknowledge(base)
+
+    def onData(self, segment):
+        layer = self.layer
+        seqnum = segment.seqnum
+        windowEnd = layer.ackCount + self.window()
+        if seqnum == layer.ackCount:
+            layer.deliverInOrder(segment.payload)
+        elif layer.ackCount < seqnum < windowEnd and seqnum not in layer.receiveBuffer:
+            layer.receiveBuffer[seqnum] = segment.payload
+
+        # Segments beyond the window are dropped unacknowledged, the sender cannot have sent them legitimately
+        if seqnum < windowEnd:
+            self.sendAck(layer.ackCount, ((seqnum, seqnum + len(segment.payload)),))
+
+
+# None selects the layer's built-in logic
+ARQ_STRATEGIES = {
+    'builtin': None,
+    'stop-and-wait': StopAndWait,
+    'go-back-n': GoBackN,
+    'selective-repeat': SelectiveRepeat,
+}
@@ -0,0 +1,625 @@
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+from functools import reduce
+
+try:
+    import numpy
+except ImportError:                                     # numpy is only needed for the BatchChannel benchmark
+    numpy = None
+
+from channel_models import CHANNEL_MODELS
+from rdt_arq import ARQ_STRATEGIES
+from rdt_events import NullSink, RingBufferSink
+from rdt_layer import RDTLayer
+from rdt_sim import runTransfer
+from segment import Segment
+from unreliable import UnreliableChannel
+
+
+# #################################################################################################################### #
+# Benchmarks                                                                                                           #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Microbenchmarks for the RDT hot paths. Each benchmark returns a dict of measurements so results can be printed as    #
+# JSON and compared between versions.                                                                                  #
+#                                                                                                                      #
+# Usage:                                                                                                               #
+#   python rdt_bench.py checksum segment send stream trace window channel transfer arq                                 #
+#   python rdt_bench.py --save-baseline baseline.json                                                                  #
+#   python rdt_bench.py --baseline baseline.json         (exits with status 1 on a regression)                         #
+#                                                                                                                      #
+# The benchmarks run --repeats times in turn and report the median of each measurement. The original checksum is timed #
+# before each run as a reference, and a benchmark's timings are compared after scaling by how much faster or slower    #
+# its reference ran than in the baseline, so a baseline saved on another machine or under another load still applies.  #
+# A timing may be --tolerance worse than the baseline, an iteration count not at all. The benchmarks with a regression #
+# run again, only measurements that regress twice fail the comparison.                                                 #
+# rdt_bench_baseline.json was saved with                                                                               #
+#   python rdt_bench.py --max-payload 1048576 --save-baseline rdt_bench_baseline.json                                  #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+def legacyChecksum(segment):
+    """
+    The original checksum: a sum of character codes over the formatted segment text
+    """
+    return reduce(lambda x, y: x + y, map(ord, segment.to_string()))
+
+
+class LegacySegment(object):
+    """
+    Attribute layout of the original Segment (plain object with a __dict__), for memory comparisons
+    """
+
+    def __init__(self):
+        self.seqnum = -1
+        self.acknum = -1
+        self.payload = ''
+        self.checksum = 0
+        self.startIteration = 0
+        self.startDelayIteration = 0
+
+
+class NullChannel(object):
+    """
+    Channel that discards everything sent through it and never delivers anything
+    """
+
+    def send(self, seg):
+        pass
+
+    def receive(self):
+        return []
+
+
+class TimedLayer(RDTLayer):
+    """
+    RDTLayer with an instance __dict__, so CallTimers can stand in for its methods
+    """
+
+
+class CallTimer(object):
+    """
+    Stands in for a bound method and adds up the time spent in it
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0.0
+
+    def __call__(self, *args):
+        start = time.perf_counter()
+        result = self.function(*args)
+        self.seconds += time.perf_counter() - start
+        return result
+
+
+def timePerCall(function, count):
+    """
+    Best of three runs of count calls, in nanoseconds per call
+    """
+    return min(timeit.repeat(function, number=count, repeat=3)) / count * 1e9
+
+
+def benchChecksum(payloadLengths=(4, 100, 1000, 8192), count=20000):
+    """
+    Per-segment cost of computing and verifying the checksum, against the original sum over to_string(),
+    and Segment.setData / calc_checksum throughput on bytes payloads
+    """
+    results = []
+    for payloadLength in payloadLengths:
+        segment = Segment()
+        segment.setData(1, 'x' * payloadLength)
+        legacyCount = count if payloadLength <= 1000 else count // 100
+        result = {
+            'payloadLength': payloadLength,
+            'legacyChecksumNs': timePerCall(lambda: legacyChecksum(segment), legacyCount),
+            'checksumNs': timePerCall(segment.calc_checksum, count),
+            'checkChecksumNs': timePerCall(segment.checkChecksum, count),
+            'setDataNs': timePerCall(lambda: segment.setData(1, segment.payload), count),
+        }
+
+        # Payloads as the layer sends them: views into the send buffer
+        payload = memoryview(b'x' * payloadLength)
+        segment.setData(1, payload)
+        checksumNs = timePerCall(segment.calc_checksum, count)
+        setDataNs = timePerCall(lambda: segment.setData(1, payload), count)
+        result.update({
+            'bytesChecksumNs': checksumNs,
+            'bytesSetDataNs': setDataNs,
+            'checksumMegabytesPerSecond': payloadLength * 1e3 / checksumNs,
+            'setDataSegmentsPerSecond': 1e9 / setDataNs,
+        })
+        results.append(result)
+    return results
+
+
+def timeReference(payloadLength=100, count=1000, repeat=10):
+    """
+    The original checksum on a small segment in nanoseconds, pure interpreter work that timings are scaled by.
+    Best of many short runs, at least one of them usually misses the other load on the machine.
+    """
+    segment = Segment()
+    segment.setData(1, 'x' * payloadLength)
+    return min(timeit.repeat(lambda: legacyChecksum(segment), number=count, repeat=repeat)) / count * 1e9
+
+
+def bytesPerInstance(factory, count):
+    """
+    Memory allocated per object when count objects built by factory are alive at once
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [factory(i) for i in range(count)]
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return allocated / count
+
+
+def benchSegment(payloadLength=100, count=20000):
+    """
+    Memory per in-flight segment and pack()/unpack() throughput
+    """
+    payload = 'x' * payloadLength
+
+    # Both layouts hold the same values, including a freshly allocated checksum
+    def fill(segment, i):
+        segment.seqnum = i
+        segment.payload = payload
+        segment.checksum = i + 2 ** 31
+        return segment
+
+    def makeSegment(i):
+        return fill(Segment(), i)
+
+    def makeLegacySegment(i):
+        return fill(LegacySegment(), i)
+
+    segment = Segment()
+    segment.setData(1, payload)
+    packed = segment.pack()
+    packNs = timePerCall(segment.pack, count)
+    unpackNs = timePerCall(lambda: Segment.unpack(packed), count)
+
+    return {
+        'payloadLength': payloadLength,
+        'wireBytes': len(packed),
+        'bytesPerSegment': bytesPerInstance(makeSegment, count),
+        'bytesPerLegacySegment': bytesPerInstance(makeLegacySegment, count),
+        'packNs': packNs,
+        'unpackNs': unpackNs,
+        'packSegmentsPerSecond': 1e9 / packNs,
+        'unpackSegmentsPerSecond': 1e9 / unpackNs,
+        'packMegabytesPerSecond': len(packed) * 1e3 / packNs,
+    }
+
+
+def benchSend(dataLengths=(4, 64, 1024, 8192), payloadBytes=1 << 20, segmentsPerWindow=64):
+    """
+    Sender CPU per byte for a first transmission of the whole payload at increasing segment sizes
+    """
+    payload = b'x' * payloadBytes
+    results = []
+    for dataLength in dataLengths:
+        client = RDTLayer(dataLength, dataLength * segmentsPerWindow)
+        client.setSendChannel(NullChannel())
+        client.setReceiveChannel(NullChannel())
+        client.setDataToSend(payload)
+
+        start = time.perf_counter()
+        while client.sentData < payloadBytes:
+            client.processSend()
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            'dataLength': dataLength,
+            'segments': client.seqCount // dataLength,
+            'nsPerByte': elapsed * 1e9 / payloadBytes,
+            'megabytesPerSecond': payloadBytes / elapsed / 1e6,
+        })
+    return results
+
+
+def benchStream(payloadBytes=64 << 20, dataLength=8192, segmentsPerWindow=64, chunkSize=1 << 16):
+    """
+    Lossless transfer of a generated stream: the sender's peak buffered bytes stay bounded while the payload grows
+    """
+    def chunks():
+        chunk = b'x' * chunkSize
+        for _ in range(payloadBytes // chunkSize):
+            yield chunk
+
+    client = RDTLayer(dataLength, dataLength * segmentsPerWindow)
+    server = RDTLayer(dataLength, dataLength * segmentsPerWindow)
+    clientToServerChannel = UnreliableChannel(False, False, False, False)
+    serverToClientChannel = UnreliableChannel(False, False, False, False)
+    client.setSendChannel(clientToServerChannel)
+    client.setReceiveChannel(serverToClientChannel)
+    server.setSendChannel(serverToClientChannel)
+    server.setReceiveChannel(clientToServerChannel)
+    client.setDataToSend(chunks())
+
+    peakBufferedBytes = 0
+    iterations = 0
+    start = time.perf_counter()
+    while server.ackCount <= payloadBytes:
+        iterations += 1
+        client.processData()
+        clientToServerChannel.processData()
+        server.processData()
+        serverToClientChannel.processData()
+        peakBufferedBytes = max(peakBufferedBytes, client.sendBuffer.bufferedBytes())
+
+        # Only the sender is measured, drop what the server delivered
+        server.readDataReceived()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'payloadBytes': payloadBytes,
+        'dataLength': dataLength,
+        'iterations': iterations,
+        'peakBufferedBytes': peakBufferedBytes,
+        'nsPerByte': elapsed * 1e9 / payloadBytes,
+        'megabytesPerSecond': payloadBytes / elapsed / 1e6,
+    }
+
+
+def benchWindow(windowSegments=(1, 4, 16, 64, 256, 1024), dataLength=1024, payloadBytes=8 << 20):
+    """
+    Lossless transfers at increasing flow-control windows: time per segment spent in the client's processSend,
+    the server's processReceiveAndSendRespond (data in, acks out) and the client's (acks in)
+    """
+    payload = b'x' * payloadBytes
+    results = []
+    for segmentsPerWindow in windowSegments:
+        client = TimedLayer(dataLength, dataLength * segmentsPerWindow)
+        server = TimedLayer(dataLength, dataLength * segmentsPerWindow)
+        clientToServerChannel = UnreliableChannel(False, False, False, False)
+        serverToClientChannel = UnreliableChannel(False, False, False, False)
+        client.setSendChannel(clientToServerChannel)
+        client.setReceiveChannel(serverToClientChannel)
+        server.setSendChannel(serverToClientChannel)
+        server.setReceiveChannel(clientToServerChannel)
+        server.setReceiveCallback(lambda data: None)
+        client.setDataToSend(payload)
+
+        # processData looks the methods up on the instance, so the timers see every call
+        client.processSend = sendTimer = CallTimer(client.processSend)
+        client.processReceiveAndSendRespond = ackTimer = CallTimer(client.processReceiveAndSendRespond)
+        server.processReceiveAndSendRespond = receiveTimer = CallTimer(server.processReceiveAndSendRespond)
+
+        iterations = 0
+        start = time.perf_counter()
+        while server.ackCount <= payloadBytes:
+            iterations += 1
+            client.processData()
+            clientToServerChannel.processData()
+            server.processData()
+            serverToClientChannel.processData()
+        elapsed = time.perf_counter() - start
+
+        segments = client.countSegmentsSent
+        results.append({
+            'segmentsPerWindow': segmentsPerWindow,
+            'iterations': iterations,
+            'processSendNsPerSegment': sendTimer.seconds * 1e9 / segments,
+            'serverReceiveNsPerSegment': receiveTimer.seconds * 1e9 / segments,
+            'clientReceiveNsPerAck': ackTimer.seconds * 1e9 / max(client.countAcksReceived, 1),
+            'segmentsPerSecond': segments / elapsed,
+            'bytesPerSecond': payloadBytes / elapsed,
+        })
+    return results
+
+
+def benchChannel(queueLengths=(1000, 10000, 100000), payloadLength=1024, rounds=3):
+    """
+    processData with every impairment enabled on large queues of data segments, for UnreliableChannel and
+    BatchChannel (skipped without numpy)
+    """
+    payload = b'x' * payloadLength
+    models = ('unreliable', 'batch') if numpy is not None else ('unreliable',)
+    results = []
+    for model, queueLength in itertools.product(models, queueLengths):
+        best = None
+        for seed in range(rounds):
+            channel = CHANNEL_MODELS[model](True, True, True, True, seed)
+            for seqnum in range(queueLength):
+                segment = Segment()
+                segment.setData(seqnum * payloadLength + 1, payload)
+                channel.send(segment)
+
+            start = time.perf_counter()
+            channel.processData()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        results.append({
+            'queueLength': queueLength,
+            'model': model,
+            'nsPerSegment': best * 1e9 / queueLength,
+            'segmentsPerSecond': queueLength / best,
+            'bytesPerSecond': queueLength * payloadLength / best,
+        })
+    return results
+
+
+def impairmentName(flags):
+    """
+    Label of a combination of the rdt_main.py impairment flags (outOfOrder, drop, delay, errors)
+    """
+    names = [name for name, flag in zip(('outOfOrder', 'drop', 'delay', 'errors'), flags) if flag]
+    return '+'.join(names) or 'reliable'
+
+
+def benchTransfer(payloadSizes=(1 << 10, 10 << 10, 100 << 10, 1 << 20, 10 << 20, 100 << 20), dataLength=1024,
+                  segmentsPerWindow=64, seed=1):
+    """
+    End-to-end transfers of every payload size under every combination of the rdt_main.py impairment flags,
+    with selective acks, the RTT based timer and fast retransmit
+    """
+    results = []
+    for payloadBytes in payloadSizes:
+        payload = b'x' * payloadBytes
+        for flags in itertools.product((False, True), repeat=4):
+            start = time.perf_counter()
+            result = runTransfer(payload, *flags, seed=seed, maxIterations=1 << 30, dataLength=dataLength,
+                                 flowControlWinSize=dataLength * segmentsPerWindow, selectiveAck=True,
+                                 adaptiveTimeout=True, fastRetransmit=True)
+            elapsed = time.perf_counter() - start
+            # Segments both channels delivered
+            segments = result.countSentPackets
+
+            results.append({
+                'payloadBytes': payloadBytes,
+                'impairments': impairmentName(flags),
+                'completed': result.completed,
+                'iterations': result.totalIterations,
+                'segments': segments,
+                'msPerTransfer': elapsed * 1e3,
+                'segmentsPerSecond': segments / elapsed,
+                'bytesPerSecond': payloadBytes / elapsed,
+            })
+    return results
+
+
+# Link profiles for the ARQ comparison: rdt_main.py impairment flags (outOfOrder, drop, delay, errors)
+LINK_PROFILES = (
+    ('reliable', (False, False, False, False)),
+    ('lossy', (False, True, False, True)),
+    ('reordering', (True, False, True, False)),
+    ('all', (True, True, True, True)),
+)
+
+
+def benchArq(payloadBytes=64 << 10, dataLength=1024, segmentsPerWindow=16, seeds=10):
+    """
+    The ARQ strategies side by side on every link profile, averaged over seeds. builtin runs with selective acks,
+    the RTT based timer and fast retransmit.
+    """
+    payload = b'x' * payloadBytes
+    results = []
+    for profile, flags in LINK_PROFILES:
+        for name, arq in ARQ_STRATEGIES.items():
+            builtin = arq is None
+            iterations = segments = completed = 0
+            start = time.perf_counter()
+            for seed in range(seeds):
+                result = runTransfer(payload, *flags, seed=seed, maxIterations=100000, dataLength=dataLength,
+                                     flowControlWinSize=dataLength * segmentsPerWindow, selectiveAck=builtin,
+                                     adaptiveTimeout=builtin, fastRetransmit=builtin, arq=arq)
+                iterations += result.totalIterations
+                segments += result.countTotalDataPackets + result.countAckPackets
+                completed += result.completed
+            elapsed = time.perf_counter() - start
+
+            results.append({
+                'profile': profile,
+                'arq': name,
+                'completed': completed / seeds,
+                'iterations': iterations / seeds,
+                'segments': segments / seeds,
+                'goodput': payloadBytes * seeds / iterations,
+                'msPerTransfer': elapsed * 1e3 / seeds,
+                'segmentsPerSecond': segments / elapsed,
+                'bytesPerSecond': payloadBytes * seeds / elapsed,
+            })
+    return results
+
+
+def benchTrace(payloadBytes=64 << 10, dataLength=64, seeds=20, repeats=3):
+    """
+    Cost of event tracing on impaired transfers: no tracer, a sink that discards events and a ring buffer
+    (best of repeats runs over seeds transfers each)
+    """
+    payload = b'x' * payloadBytes
+    tracers = (('none', lambda: None), ('null', NullSink), ('ringBuffer', RingBufferSink))
+    results = {}
+    for name, makeTracer in tracers:
+        best = None
+        for _ in range(repeats):
+            events = 0
+            start = time.perf_counter()
+            for seed in range(seeds):
+                tracer = makeTracer()
+                runTransfer(payload, True, True, True, True, seed, dataLength=dataLength,
+                            flowControlWinSize=dataLength * 16, selectiveAck=True, adaptiveTimeout=True,
+                            fastRetransmit=True, tracer=tracer)
+                events += getattr(tracer, 'countEvents', 0)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = {'msPerTransfer': best * 1e3 / seeds, 'eventsPerTransfer': events / seeds}
+    return results
+
+
+BENCHMARKS = {
+    'checksum': benchChecksum,
+    'segment': benchSegment,
+    'send': benchSend,
+    'stream': benchStream,
+    'trace': benchTrace,
+    'window': benchWindow,
+    'channel': benchChannel,
+    'transfer': benchTransfer,
+    'arq': benchArq,
+}
+
+
+def entryKey(entry):
+    """
+    Identifies an entry of a benchmark's result list across runs
+    """
+    first = next(iter(entry))
+    fields = [first] + [name for name, value in entry.items() if name != first and isinstance(value, str)]
+    return ','.join('%s=%s' % (name, entry[name]) for name in fields)
+
+
+def flatten(results, prefix=''):
+    """
+    {path: value} for every number in nested benchmark results, list entries are keyed by their first field and
+    their text fields (e.g. "checksum/payloadLength=100/checksumNs")
+    """
+    if isinstance(results, dict):
+        items = results.items()
+    else:
+        items = ((entryKey(entry), entry) for entry in results)
+
+    flat = {}
+    for key, value in items:
+        path = prefix + str(key)
+        if isinstance(value, (dict, list)):
+            flat.update(flatten(value, path + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def medianRun(runs, name=''):
+    """
+    Merges the results of repeated runs of a benchmark field by field: the median of every timing and rate,
+    the first run's value of everything else
+    """
+    first = runs[0]
+    if isinstance(first, dict):
+        return {key: medianRun([run[key] for run in runs], key) for key in first}
+    if isinstance(first, list):
+        return [medianRun(list(entries)) for entries in zip(*runs)]
+    if isTiming(name) or 'PerSecond' in name:
+        return statistics.median(runs)
+    return first
+
+
+def isTiming(path):
+    name = path.rsplit('/', 1)[-1]
+    return name.endswith('Ns') or name.startswith(('nsPer', 'msPer')) or 'NsPer' in name
+
+
+def isIterations(path):
+    return path.rsplit('/', 1)[-1] == 'iterations'
+
+
+def isCompared(path):
+    """
+    Timings and iteration counts, all lower is better. Rates (*PerSecond) are derived from the timings and sizes, and
+    sizes, lengths and counts only describe the run.
+    """
+    return not path.startswith('reference/') and (isTiming(path) or isIterations(path))
+
+
+def compareResults(baseline, results, tolerance):
+    """
+    Measurements in results that are worse than in baseline: timings by more than tolerance (a fraction), iteration
+    counts (the transfers are seeded, so they are exact) by anything. The timings of a benchmark are scaled by how
+    much slower or faster its reference ran, when both runs timed it.
+    """
+    baseline = flatten(baseline)
+    results = flatten(results)
+
+    regressions = []
+    for path, value in sorted(results.items()):
+        if not isCompared(path) or not baseline.get(path):
+            continue
+        expected = baseline[path]
+        reference = 'reference/' + path.split('/', 1)[0]
+        if isTiming(path) and baseline.get(reference) and results.get(reference):
+            expected *= results[reference] / baseline[reference]
+        change = (value - expected) / expected
+        if change > (0 if isIterations(path) else tolerance):
+            regressions.append({'measurement': path, 'baseline': expected, 'current': value, 'change': change})
+    return regressions
+
+
+def runBenchmarks(names, repeats, maxPayload=None):
+    """
+    Results of the named benchmarks, the median of repeats runs, with the median reference timing of each
+    """
+    runs = {name: [] for name in names}
+    referenceNs = {name: [] for name in names}
+
+    # Round robin, so the runs of a benchmark are spread over the whole session rather than one busy stretch of it
+    for _ in range(repeats):
+        for name in names:
+            referenceNs[name].append(timeReference())
+            if name == 'transfer' and maxPayload is not None:
+                runs[name].append(benchTransfer([size for size in benchTransfer.__defaults__[0] if size <= maxPayload]))
+            else:
+                runs[name].append(BENCHMARKS[name]())
+
+    results = {name: medianRun(runs[name]) for name in names}
+    results['reference'] = {name: statistics.median(referenceNs[name]) for name in names}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run RDT microbenchmarks and print the results as JSON')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help='benchmarks to run: %s (default: all)' % ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--max-payload', type=int, default=None, metavar='BYTES',
+                        help='skip transfer benchmark payloads larger than BYTES')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results to PATH for later comparison')
+    parser.add_argument('--baseline', metavar='PATH', help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='fraction a timing may be worse than the baseline (default: 0.5)')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='runs of every benchmark to take the median of (default: 5)')
+    args = parser.parse_args()
+    # Checked here, argparse rejects an empty list against choices
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %r' % name)
+
+    results = runBenchmarks(args.benchmarks or sorted(BENCHMARKS), args.repeats, args.max_payload)
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compareResults(baseline, results, args.tolerance)
+
+        # A slow stretch of the machine rarely hits the same measurement twice: the benchmarks concerned run again,
+        # and only the measurements that regress again are reported
+        if regressions:
+            names = sorted({regression['measurement'].split('/', 1)[0] for regression in regressions})
+            again = compareResults(baseline, runBenchmarks(names, args.repeats, args.max_payload), args.tolerance)
+            confirmed = {regression['measurement'] for regression in again}
+            regressions = [regression for regression in regressions if regression['measurement'] in confirmed]
+
+        for regression in regressions:
+            print('REGRESSION {measurement}: {baseline:.6g} -> {current:.6g} ({change:+.1%})'.format(**regression),
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
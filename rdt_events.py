@@ -0,0 +1,140 @@
+import json
+import struct
+
+
+# #################################################################################################################### #
+# Event tracing                                                                                                        #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Typed events emitted by RDTLayer (send, retransmit, ack, deliver) and the channels (drop, delay, corrupt) when a     #
+# tracer is set on them with setTracer(). Every emission site is guarded by `if self.tracer is not None`, so a run     #
+# without a tracer does no tracing work at all. A tracer is any object with the emit() / emitSegment() methods of      #
+# TraceSink; one sink can be shared by both layers and both channels.                                                  #
+#                                                                                                                      #
+# Every event carries the iteration it happened in, the connection id, a sequence number, an ack number (-1 when the   #
+# event has none) and a payload length in bytes.                                                                       #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+SEND = 0
+RETRANSMIT = 1
+ACK = 2
+DROP = 3
+DELAY = 4
+CORRUPT = 5
+DELIVER = 6
+
+EVENT_NAMES = ('send', 'retransmit', 'ack', 'drop', 'delay', 'corrupt', 'deliver')
+
+
+class TraceSink(object):
+    """
+    Base class of the sinks: emitSegment() fills in the event fields from a segment
+    """
+
+    def emit(self, kind, iteration, connectionId, seqnum, acknum, length, segment=None):
+        raise NotImplementedError
+
+    def emitSegment(self, kind, iteration, segment):
+        self.emit(kind, iteration, segment.connectionId, segment.seqnum, segment.acknum, len(segment.payload), segment)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NullSink(TraceSink):
+    """
+    Discards every event. Leaving the tracer unset is cheaper still, this is for callers that need a sink object.
+    """
+
+    def emit(self, kind, iteration, connectionId, seqnum, acknum, length, segment=None):
+        pass
+
+    def emitSegment(self, kind, iteration, segment):
+        pass
+
+
+class RingBufferSink(TraceSink):
+    """
+    Keeps the last capacity events as fixed size binary records in a preallocated buffer, overwriting the oldest
+    ones. Memory use does not grow with the length of the run.
+    """
+    CAPACITY = 65536                                    # Default number of events kept
+    RECORD = struct.Struct('!BdIqqI')                   # kind, iteration, connection id, seqnum, acknum, length
+
+    def __init__(self, capacity=None):
+        self.capacity = RingBufferSink.CAPACITY if capacity is None else capacity
+        self.buffer = bytearray(self.capacity * RingBufferSink.RECORD.size)
+        self.countEvents = 0                            # Events emitted in total, including the overwritten ones
+
+    def emit(self, kind, iteration, connectionId, seqnum, acknum, length, segment=None):
+        offset = self.countEvents % self.capacity * RingBufferSink.RECORD.size
+        RingBufferSink.RECORD.pack_into(self.buffer, offset, kind, iteration, connectionId, seqnum, acknum, length)
+        self.countEvents += 1
+
+    def toBytes(self):
+        """
+        The records held, oldest first
+        """
+        if self.countEvents <= self.capacity:
+            return bytes(self.buffer[:self.countEvents * RingBufferSink.RECORD.size])
+        split = self.countEvents % self.capacity * RingBufferSink.RECORD.size
+        return bytes(self.buffer[split:] + self.buffer[:split])
+
+    def events(self):
+        """
+        The events held as (kind, iteration, connectionId, seqnum, acknum, length) tuples, oldest first
+        """
+        return list(RingBufferSink.RECORD.iter_unpack(self.toBytes()))
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.toBytes())
+
+
+class JsonLinesSink(TraceSink):
+    """
+    Writes one JSON object per event to a file
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.countEvents = 0
+
+    def emit(self, kind, iteration, connectionId, seqnum, acknum, length, segment=None):
+        self.file.write(json.dumps({
+            'event': EVENT_NAMES[kind],
+            'iteration': iteration,
+            'connectionId': connectionId,
+            'seqnum': seqnum,
+            'acknum': acknum,
+            'length': length,
+        }))
+        self.file.write('\n')
+        self.countEvents += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ConsoleSink(TraceSink):
+    """
+    Prints every event on stdout, segments in the form RDTLayer used to print them
+    """
+    LABELS = ('Sending segment: ', 'Retransmitting segment: ', 'Sending ack: ', 'Dropped segment: ',
+              'Delayed segment: ', 'Corrupted segment: ')
+
+    def emit(self, kind, iteration, connectionId, seqnum, acknum, length, segment=None):
+        if kind == DELIVER:
+            print("Delivered {0} bytes from seq: {1}".format(length, seqnum))
+        elif segment is not None:
+            print(ConsoleSink.LABELS[kind], segment.to_string())
+        else:
+            print(ConsoleSink.LABELS[kind], "seq: {0}, ack: {1}, length: {2}".format(seqnum, acknum, length))
@@ -0,0 +1,143 @@
+import csv
+import json
+
+
+# #################################################################################################################### #
+# Metrics                                                                                                              #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Per-iteration time series of a transfer. RDTLayer.getMetrics() and UnreliableChannel.getMetrics() return cumulative  #
+# counters and current gauges; TransferMetrics samples both ends and both channels once per iteration, turns the       #
+# counters into per-iteration rates and records them in a MetricsRegistry, which exports the series as CSV, as JSON    #
+# or as histograms.                                                                                                    #
+#                                                                                                                      #
+# Series (client -> server data):                                                                                      #
+#   goodput              bytes the server delivered in order this iteration                                            #
+#   retransmissionRatio  share of the client's data segments this iteration that were retransmissions                  #
+#   windowOccupancy      bytes the client sent this iteration over its send window                                     #
+#   bytesInFlight        bytes the client sent that are not acknowledged yet                                           #
+#   receiveBufferBytes   out-of-order bytes the server holds                                                           #
+#   ackRate              acks the client processed this iteration                                                      #
+# followed by every channel metric, prefixed with toServer / toClient.                                                 #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+CHANNEL_GAUGES = ('queuedPackets', 'heldPackets', 'bottleneckPackets', 'inFlightPackets')
+
+
+class MetricsRegistry(object):
+    """
+    Named series sampled at the same iterations
+    """
+
+    def __init__(self):
+        self.iterations = []
+        self.series = {}
+
+    def record(self, iteration, values):
+        """
+        Adds one sample of every series in values, a dict of name to value
+        """
+        for name, value in values.items():
+            # A series that appears late is padded so every series lines up with iterations
+            self.series.setdefault(name, [None] * len(self.iterations)).append(value)
+        self.iterations.append(iteration)
+
+    def toDict(self):
+        result = {'iteration': self.iterations}
+        result.update(self.series)
+        return result
+
+    def toJson(self):
+        return json.dumps(self.toDict())
+
+    def writeCsv(self, file):
+        """
+        Writes one row per iteration, one column per series
+        """
+        writer = csv.writer(file)
+        writer.writerow(['iteration'] + list(self.series))
+        for row in zip(self.iterations, *self.series.values()):
+            writer.writerow(row)
+
+    def histogram(self, name, bins=10):
+        """
+        Distribution of a series over bins equal-width bins between its smallest and largest value
+        """
+        values = [value for value in self.series[name] if value is not None]
+        if not values:
+            return {'edges': [], 'counts': []}
+
+        low, high = min(values), max(values)
+        width = (high - low) / bins or 1
+        counts = [0] * bins
+        for value in values:
+            counts[min(int((value - low) / width), bins - 1)] += 1
+        return {'edges': [low + width * i for i in range(bins + 1)], 'counts': counts}
+
+    def histograms(self, bins=10):
+        return {name: self.histogram(name, bins) for name in self.series}
+
+    def stalls(self, name='goodput', minLength=1):
+        """
+        (first, last) iterations of every run of at least minLength samples in which the series stayed at 0
+        """
+        runs = []
+        first = None
+        for iteration, value in zip(self.iterations, self.series.get(name, ())):
+            if value == 0:
+                if first is None:
+                    first = iteration
+                last = iteration
+            elif first is not None:
+                runs.append((first, last))
+                first = None
+        if first is not None:
+            runs.append((first, last))
+        return [(first, last) for first, last in runs if last - first + 1 >= minLength]
+
+
+class TransferMetrics(object):
+    """
+    Samples a client, a server and their channels into a MetricsRegistry, call sample() once per iteration
+    """
+
+    def __init__(self, client, server, clientToServerChannel, serverToClientChannel, registry=None):
+        self.client = client
+        self.server = server
+        self.channels = (('toServer', clientToServerChannel), ('toClient', serverToClientChannel))
+        self.registry = MetricsRegistry() if registry is None else registry
+        self.previous = None                            # Metrics of the previous sample, counters are reported as deltas
+
+    def sample(self, iteration):
+        current = {
+            'client': self.client.getMetrics(),
+            'server': self.server.getMetrics(),
+        }
+        for prefix, channel in self.channels:
+            current[prefix] = channel.getMetrics()
+
+        previous = self.previous or {
+            part: {name: 0 for name in metrics} for part, metrics in current.items()
+        }
+        self.previous = current
+
+        client, server = current['client'], current['server']
+        delta = lambda part, name: current[part][name] - previous[part][name]
+
+        segments = delta('client', 'segmentsSent') + delta('client', 'retransmittedSegments')
+        values = {
+            'goodput': delta('server', 'bytesDelivered'),
+            'retransmissionRatio': delta('client', 'retransmittedSegments') / segments if segments else 0.0,
+            'windowOccupancy': delta('client', 'bytesSent') / client['sendWindow'] if client['sendWindow'] else 0.0,
+            'bytesInFlight': client['bytesInFlight'],
+            'receiveBufferBytes': server['receiveBufferBytes'],
+            'ackRate': delta('client', 'acksReceived'),
+        }
+        for prefix, _ in self.channels:
+            for name, value in current[prefix].items():
+                key = prefix + name[0].upper() + name[1:]
+                values[key] = value if name in CHANNEL_GAUGES else value - previous[prefix][name]
+
+        self.registry.record(iteration, values)
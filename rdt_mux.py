@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import random
+import time
+
+from channel_models import CHANNEL_MODELS
+from rdt_events import ConsoleSink
+from rdt_layer import RDTLayer
+from unreliable import UnreliableChannel
+
+
+# #################################################################################################################### #
+# Connection multiplexing                                                                                              #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Runs many client -> server transfers over one shared pair of channels. Every connection stamps its segments with its #
+# connection id, a ConnectionDemux per direction hands each connection only its own segments, and the scheduler        #
+# advances every unfinished session once per iteration, in the same order as rdt_sim.py. Finished sessions are dropped #
+# from the schedule and their layers released, so only live connections cost anything. A live connection is two        #
+# RDTLayers, whose attributes are slots (about 1.8 KB each before anything is sent), the segments in flight (each      #
+# holding a view of the send buffer) and the timing, SACK and receive buffer entries kept for them: about 10 KB with 4 #
+# byte segments.                                                                                                       #
+#                                                                                                                      #
+# Usage:                                                                                                               #
+#   python rdt_mux.py --sessions 10000 --size 1000 --all --seed 7                                                      #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+DEFAULT_MAX_ITERATIONS = 10000
+
+
+class ConnectionPort(object):
+    """
+    Receiving end of a shared channel for one connection: receive() returns the segments the demultiplexer
+    routed to it (the connection sends straight into the shared channel)
+    """
+    __slots__ = ('inbox',)
+
+    def __init__(self):
+        self.inbox = []
+
+    def receive(self):
+        inbox, self.inbox = self.inbox, []
+        return inbox
+
+
+class ConnectionDemux(object):
+    """
+    Routes the segments a shared channel delivers to the port of their connection id
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.ports = {}
+        self.countUnroutedSegments = 0                  # Segments for connections that are closed (or never existed)
+
+    def open(self, connectionId):
+        port = ConnectionPort()
+        self.ports[connectionId] = port
+        return port
+
+    def close(self, connectionId):
+        del self.ports[connectionId]
+
+    def dispatch(self):
+        ports = self.ports
+        for seg in self.channel.receive():
+            port = ports.get(seg.connectionId)
+            if port is None:
+                self.countUnroutedSegments += 1
+            else:
+                port.inbox.append(seg)
+
+
+class Session(object):
+    """
+    Per-connection state kept by the scheduler, the layers are released once the connection finishes
+    """
+    __slots__ = ('connectionId', 'client', 'server', 'receivedBytes', 'finishedIteration')
+
+    def __init__(self, connectionId, client, server):
+        self.connectionId = connectionId
+        self.client = client
+        self.server = server
+        self.receivedBytes = 0
+        self.finishedIteration = None
+
+    def delivered(self, payload):
+        self.receivedBytes += len(payload)
+
+
+class MultiplexResult(object):
+    """
+    Aggregate outcome of a multiplexed run. Goodput is payload bytes per iteration; fairness is Jain's index over
+    the per-session goodputs, 1.0 when every session got the same share.
+    """
+
+    FIELDS = (
+        'sessions',
+        'completedSessions',
+        'totalIterations',
+        'payloadBytes',
+        'aggregateGoodput',
+        'meanSessionGoodput',
+        'jainFairness',
+        'medianIterations',
+        'p99Iterations',
+        'countSentPackets',
+        'countUnroutedSegments',
+        'elapsedSeconds',
+        'segmentsPerSecond',
+    )
+
+    def __init__(self, sessions, payloadBytes, loopIter, clientToServerChannel, serverToClientChannel, demuxes, elapsed):
+        finished = sorted(s.finishedIteration for s in sessions if s.finishedIteration is not None)
+        goodputs = [s.receivedBytes / (s.finishedIteration or loopIter) for s in sessions]
+
+        self.sessions = len(sessions)
+        self.completedSessions = len(finished)
+        self.totalIterations = loopIter
+        self.payloadBytes = payloadBytes
+        self.aggregateGoodput = sum(s.receivedBytes for s in sessions) / loopIter if loopIter else 0.0
+        self.meanSessionGoodput = sum(goodputs) / len(goodputs) if goodputs else 0.0
+        self.jainFairness = jainFairness(goodputs)
+        self.medianIterations = finished[len(finished) // 2] if finished else None
+        self.p99Iterations = finished[min(len(finished) - 1, len(finished) * 99 // 100)] if finished else None
+        self.countSentPackets = clientToServerChannel.countSentPackets + serverToClientChannel.countSentPackets
+        self.countUnroutedSegments = sum(demux.countUnroutedSegments for demux in demuxes)
+        self.elapsedSeconds = elapsed
+        self.segmentsPerSecond = self.countSentPackets / elapsed if elapsed else 0.0
+
+    def toDict(self):
+        return {name: getattr(self, name) for name in MultiplexResult.FIELDS}
+
+    def toJson(self):
+        return json.dumps(self.toDict())
+
+
+def jainFairness(values):
+    """
+    Jain's fairness index: (sum x)^2 / (n * sum x^2)
+    """
+    squares = sum(x * x for x in values)
+    return sum(values) ** 2 / (len(values) * squares) if squares else 1.0
+
+
+def runMultiplexed(sessionCount, dataToSend, outOfOrder=False, dropPackets=False, delayPackets=False,
+                   dataErrors=False, seed=None, maxIterations=DEFAULT_MAX_ITERATIONS, quiet=True, dataLength=None,
+                   flowControlWinSize=None, congestionControl=False, selectiveAck=False, adaptiveTimeout=False,
+                   fastRetransmit=False, channelModel=UnreliableChannel, channelOptions=None):
+    """
+    Runs sessionCount transfers of dataToSend (str or bytes) at once, every client -> server connection over the
+    same pair of channels, and returns a MultiplexResult. quiet=False prints the events of every connection and
+    both channels. The remaining options are those of rdt_sim.runTransfer.
+    """
+    channelSeeds = [None, None]
+    if seed is not None:
+        seeds = random.Random(seed)
+        channelSeeds = [seeds.getrandbits(64), seeds.getrandbits(64)]
+
+    channelOptions = channelOptions or {}
+    clientToServerChannel = channelModel(outOfOrder, dropPackets, delayPackets, dataErrors, channelSeeds[0],
+                                         **channelOptions)
+    serverToClientChannel = channelModel(outOfOrder, dropPackets, delayPackets, dataErrors, channelSeeds[1],
+                                         **channelOptions)
+    tracer = None if quiet else ConsoleSink()
+    clientToServerChannel.setTracer(tracer)
+    serverToClientChannel.setTracer(tracer)
+    toServer = ConnectionDemux(clientToServerChannel)
+    toClient = ConnectionDemux(serverToClientChannel)
+
+    # Every client sends a view of the same buffer
+    if isinstance(dataToSend, str):
+        dataToSend = dataToSend.encode('utf-8')
+    payloadBytes = len(dataToSend)
+
+    sessions = []
+    for connectionId in range(1, sessionCount + 1):
+        client = RDTLayer(dataLength, flowControlWinSize, congestionControl, selectiveAck, adaptiveTimeout,
+                          fastRetransmit)
+        server = RDTLayer(dataLength, flowControlWinSize, selectiveAck=selectiveAck)
+        session = Session(connectionId, client, server)
+
+        client.setConnectionId(connectionId)
+        server.setConnectionId(connectionId)
+        client.setSendChannel(clientToServerChannel)
+        client.setReceiveChannel(toClient.open(connectionId))
+        server.setSendChannel(serverToClientChannel)
+        server.setReceiveChannel(toServer.open(connectionId))
+        server.setReceiveCallback(session.delivered)
+        client.setTracer(tracer)
+        server.setTracer(tracer)
+        client.setDataToSend(dataToSend)
+        sessions.append(session)
+
+    active = list(sessions)
+    loopIter = 0
+    start = time.perf_counter()
+    while active and loopIter < maxIterations:
+        loopIter += 1
+
+        for session in active:
+            session.client.processData()
+        clientToServerChannel.processData()
+        toServer.dispatch()
+
+        for session in active:
+            session.server.processData()
+        serverToClientChannel.processData()
+        toClient.dispatch()
+
+        stillActive = []
+        for session in active:
+            if session.receivedBytes == payloadBytes:
+                session.finishedIteration = loopIter
+                toServer.close(session.connectionId)
+                toClient.close(session.connectionId)
+
+                # Only the counters are reported, the layers (and any segments they still buffer) can go
+                session.client = session.server = None
+            else:
+                stillActive.append(session)
+        active = stillActive
+
+    elapsed = time.perf_counter() - start
+    return MultiplexResult(sessions, payloadBytes, loopIter, clientToServerChannel, serverToClientChannel,
+                           (toServer, toClient), elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many multiplexed RDT transfers and print aggregate results as JSON')
+    parser.add_argument('--sessions', type=int, default=1000, help='number of concurrent connections')
+    parser.add_argument('--size', type=int, default=1000, help='bytes each connection sends')
+    parser.add_argument('--out-of-order', action='store_true', help='channel can deliver out of order')
+    parser.add_argument('--drop', action='store_true', help='channel can drop packets')
+    parser.add_argument('--delay', action='store_true', help='channel can delay packets')
+    parser.add_argument('--errors', action='store_true', help='channel can corrupt packets')
+    parser.add_argument('--all', action='store_true', help='enable every channel impairment')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for the channel impairments')
+    parser.add_argument('--max-iterations', type=int, default=DEFAULT_MAX_ITERATIONS)
+    parser.add_argument('--mss', type=int, default=None, help='bytes per segment (default: RDTLayer.DATA_LENGTH)')
+    parser.add_argument('--window', type=int, default=None,
+                        help='flow-control window in bytes (default: RDTLayer.FLOW_CONTROL_WIN_SIZE)')
+    parser.add_argument('--congestion-control', action='store_true', help='enable slow start / AIMD in the sender')
+    parser.add_argument('--sack', action='store_true', help='enable selective acknowledgements')
+    parser.add_argument('--adaptive-timeout', action='store_true', help='retransmit on an RTT based timer')
+    parser.add_argument('--fast-retransmit', action='store_true', help='retransmit after three duplicate acks')
+    parser.add_argument('--channel', choices=sorted(CHANNEL_MODELS), default='unreliable',
+                        help='channel model shared by all connections, with its default options')
+    args = parser.parse_args()
+
+    result = runMultiplexed(args.sessions, os.urandom(args.size),
+                            outOfOrder=args.out_of_order or args.all,
+                            dropPackets=args.drop or args.all,
+                            delayPackets=args.delay or args.all,
+                            dataErrors=args.errors or args.all,
+                            seed=args.seed,
+                            maxIterations=args.max_iterations,
+                            dataLength=args.mss,
+                            flowControlWinSize=args.window,
+                            congestionControl=args.congestion_control,
+                            selectiveAck=args.sack,
+                            adaptiveTimeout=args.adaptive_timeout,
+                            fastRetransmit=args.fast_retransmit,
+                            channelModel=CHANNEL_MODELS[args.channel])
+    print(result.toJson())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import csv
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from channel_models import CHANNEL_MODELS
+from rdt_arq import ARQ_STRATEGIES
+from rdt_layer import RDTLayer
+from rdt_sim import runTransfer
+from unreliable import UnreliableChannel
+
+
+# #################################################################################################################### #
+# Parameter sweep                                                                                                      #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Runs rdt_sim.runTransfer for every point of a grid over the ARQ scheme, segment size (MSS), flow-control window      #
+# and the channel impairment ratios, with many seeds per point, on a pool of worker processes. The runs of each point  #
+# are aggregated into one row: completion rate and the mean and percentiles of iterations, segment counts and goodput. #
+#                                                                                                                      #
+# An impairment is enabled when its ratio is above 0. The ratios are UnreliableChannel class constants, a worker sets  #
+# them for the duration of a run; workers run one simulation at a time, so runs never see each other's ratios.         #
+#                                                                                                                      #
+# Usage:                                                                                                               #
+#   python rdt_sweep.py --arq go-back-n selective-repeat --window 16 64 256 --drop 0 0.05 0.1 0.2 --seeds 50           #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+DEFAULT_SEEDS = 20
+PERCENTILES = (50, 90, 99)
+
+# Grid axes: name, runTransfer keyword or UnreliableChannel ratio, default values
+AXES = (
+    ('arq', 'arq', ('builtin',)),
+    ('mss', 'dataLength', (4, 16, 64)),
+    ('window', 'flowControlWinSize', (15, 64, 256)),
+    ('drop', 'RATIO_DROPPED_PACKETS', (0.0, 0.05, 0.1, 0.2)),
+    ('delay', 'RATIO_DELAYED_PACKETS', (UnreliableChannel.RATIO_DELAYED_PACKETS,)),
+    ('errors', 'RATIO_DATA_ERROR_PACKETS', (UnreliableChannel.RATIO_DATA_ERROR_PACKETS,)),
+    ('outOfOrder', 'RATIO_OUT_OF_ORDER_PACKETS', (UnreliableChannel.RATIO_OUT_OF_ORDER_PACKETS,)),
+)
+
+# runTransfer flag enabled by each ratio
+RATIO_FLAGS = {
+    'RATIO_OUT_OF_ORDER_PACKETS': 'outOfOrder',
+    'RATIO_DROPPED_PACKETS': 'dropPackets',
+    'RATIO_DELAYED_PACKETS': 'delayPackets',
+    'RATIO_DATA_ERROR_PACKETS': 'dataErrors',
+}
+
+
+@contextlib.contextmanager
+def channelRatios(ratios):
+    """
+    Sets UnreliableChannel.RATIO_* constants, restoring them afterwards
+    """
+    saved = {name: getattr(UnreliableChannel, name) for name in ratios}
+    try:
+        for name, value in ratios.items():
+            setattr(UnreliableChannel, name, value)
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(UnreliableChannel, name, value)
+
+
+@functools.lru_cache(maxsize=None)
+def sweepPayload(size):
+    """
+    The data sent in every run: the rdt_main.py payload, or size pseudo-random bytes (the same in every worker)
+    """
+    if size is None:
+        from rdt_main import dataToSend
+        return dataToSend
+    return random.Random(size).randbytes(size)
+
+
+def runSweepTask(task):
+    """
+    Runs one seed of one grid point in a worker process and returns its measurements
+    """
+    point, seed, payloadSize, options = task
+    payload = sweepPayload(payloadSize)
+
+    keywords = dict(options)
+    ratios = {}
+    for name, key, _ in AXES:
+        if key in RATIO_FLAGS:
+            ratios[key] = point[name]
+            keywords[RATIO_FLAGS[key]] = point[name] > 0
+        elif key == 'arq':
+            keywords[key] = ARQ_STRATEGIES[point[name]]
+            # The protocol options only apply to the built-in logic
+            if keywords[key] is not None:
+                for option in RDTLayer.BUILTIN_OPTIONS:
+                    keywords.pop(option, None)
+        else:
+            keywords[key] = point[name]
+    channelModel = CHANNEL_MODELS[keywords.pop('channel', 'unreliable')]
+
+    with channelRatios(ratios):
+        result = runTransfer(payload, seed=seed, channelModel=channelModel, **keywords)
+
+    payloadBytes = len(payload.encode('utf-8')) if isinstance(payload, str) else len(payload)
+    return {
+        'completed': result.completed,
+        'iterations': result.totalIterations,
+        'segments': result.countTotalDataPackets + result.countAckPackets,
+        'goodput': payloadBytes / result.totalIterations if result.completed else 0.0,
+    }
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    return values[max(0, math.ceil(len(values) * p / 100) - 1)]
+
+
+def aggregate(point, runs):
+    """
+    One results table row for the runs of a grid point
+    """
+    row = dict(point)
+    row['runs'] = len(runs)
+    row['completed'] = sum(run['completed'] for run in runs) / len(runs)
+    for measure in ('iterations', 'segments', 'goodput'):
+        values = sorted(run[measure] for run in runs)
+        row[measure + 'Mean'] = sum(values) / len(values)
+        for p in PERCENTILES:
+            row['%sP%d' % (measure, p)] = percentile(values, p)
+    return row
+
+
+def runSweep(grid, seeds=DEFAULT_SEEDS, payloadSize=None, workers=None, **options):
+    """
+    Runs every point of grid, a dict of axis name (see AXES) to the values to sweep, with seeds 0 .. seeds - 1 and
+    returns one aggregated row per point. Axes left out keep their defaults. payloadSize sends that many random
+    bytes instead of the rdt_main.py payload, workers is the number of processes (default: one per core) and the
+    remaining options (selectiveAck, maxIterations, channel, ...) are passed on to rdt_sim.runTransfer; the
+    built-in logic's options (RDTLayer.BUILTIN_OPTIONS) only apply to the points whose arq is builtin.
+    """
+    names = [name for name, _, _ in AXES]
+    unknown = set(grid) - set(names)
+    if unknown:
+        raise ValueError('unknown sweep axes: %s' % ', '.join(sorted(unknown)))
+
+    values = [grid.get(name, default) for name, _, default in AXES]
+    points = [dict(zip(names, combination)) for combination in itertools.product(*values)]
+    tasks = [(point, seed, payloadSize, options) for point in points for seed in range(seeds)]
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Batches of tasks per round trip, while still giving every worker several batches to balance the load
+        chunksize = max(1, len(tasks) // (workers * 8))
+        runs = list(executor.map(runSweepTask, tasks, chunksize=chunksize))
+
+    return [aggregate(point, runs[i * seeds:(i + 1) * seeds]) for i, point in enumerate(points)]
+
+
+def formatTable(rows):
+    """
+    rows as a text table with aligned columns
+    """
+    columns = list(rows[0])
+    cells = [[('%.4g' % row[c]) if isinstance(row[c], float) else str(row[c]) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(line[i]) for line in cells)) for i, c in enumerate(columns)]
+    lines = ['  '.join(c.rjust(w) for c, w in zip(columns, widths))]
+    lines.extend('  '.join(cell.rjust(w) for cell, w in zip(line, widths)) for line in cells)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep RDT parameters over many seeds and print a results table')
+    parser.add_argument('--arq', nargs='+', choices=sorted(ARQ_STRATEGIES),
+                        help='retransmission schemes (default: builtin, see rdt_arq.py)')
+    parser.add_argument('--mss', type=int, nargs='+', help='segment sizes in bytes (default: 4 16 64)')
+    parser.add_argument('--window', type=int, nargs='+', help='flow-control windows in bytes (default: 15 64 256)')
+    parser.add_argument('--drop', type=float, nargs='+', help='drop ratios (default: 0 0.05 0.1 0.2)')
+    parser.add_argument('--delay', type=float, nargs='+', help='delay ratios (default: the UnreliableChannel one)')
+    parser.add_argument('--errors', type=float, nargs='+',
+                        help='corruption ratios (default: the UnreliableChannel one)')
+    parser.add_argument('--out-of-order', dest='outOfOrder', type=float, nargs='+',
+                        help='reordering ratios (default: the UnreliableChannel one)')
+    parser.add_argument('--seeds', type=int, default=DEFAULT_SEEDS, help='runs per grid point')
+    parser.add_argument('--size', type=int, default=None,
+                        help='bytes of random data to send (default: the rdt_main.py payload)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--max-iterations', type=int, default=10000)
+    parser.add_argument('--congestion-control', action='store_true', help='enable slow start / AIMD in the sender')
+    parser.add_argument('--sack', action='store_true', help='enable selective acknowledgements')
+    parser.add_argument('--adaptive-timeout', action='store_true', help='retransmit on an RTT based timer')
+    parser.add_argument('--fast-retransmit', action='store_true',
+                        help='retransmit after three duplicate acks (useful with --adaptive-timeout)')
+    parser.add_argument('--delayed-ack', action='store_true', help='server sends one cumulative ack per iteration')
+    parser.add_argument('--channel', choices=sorted(CHANNEL_MODELS), default='unreliable',
+                        help='channel model, with its default options (see channel_models.py)')
+    parser.add_argument('--format', choices=('table', 'csv', 'json'), default='table', help='output format')
+    args = parser.parse_args()
+
+    grid = {name: getattr(args, name) for name, _, _ in AXES if getattr(args, name) is not None}
+    rows = runSweep(grid, args.seeds, args.size, args.workers,
+                    maxIterations=args.max_iterations,
+                    congestionControl=args.congestion_control,
+                    selectiveAck=args.sack,
+                    adaptiveTimeout=args.adaptive_timeout,
+                    fastRetransmit=args.fast_retransmit,
+                    delayedAck=args.delayed_ack,
+                    channel=args.channel)
+
+    if args.format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    elif args.format == 'json':
+        print(json.dumps(rows, indent=2))
+    else:
+        print(formatTable(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+
+from channel_trace import DELAY, DROP, REORDER
+from rdt_events import ConsoleSink
+from rdt_layer import RDTLayer
+from rdt_sim import DeliveryCheck
+from segment import Segment
+from unreliable import UnreliableChannel
+
+
+# #################################################################################################################### #
+# UDP driver                                                                                                           #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Runs a client and a server RDTLayer over real UDP sockets on 127.0.0.1 with asyncio. Segments travel as              #
+# Segment.pack() datagrams through an ImpairmentProxy that reorders, delays, drops and corrupts them with the          #
+# UnreliableChannel ratios as they arrive, in wall-clock time. The layers are ticked every tick seconds and time       #
+# their retransmissions with a wall-clock clock (in ticks).                                                            #
+#                                                                                                                      #
+#   client  <-->  proxy  <-->  server                                                                                  #
+#                                                                                                                      #
+# Usage:                                                                                                               #
+#   python rdt_udp.py --all --size 1000000                                                                             #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+DEFAULT_TICK = 0.001                                    # Seconds between processData() calls
+DEFAULT_TIMEOUT = 60.0                                  # Seconds before a transfer is abandoned
+DEFAULT_DATA_LENGTH = 1024                              # Bytes per segment
+DEFAULT_WIN_SIZE = 64 * 1024                            # Flow-control window (in bytes)
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024                    # Requested socket buffer size, a whole window is sent at once
+
+
+def enlargeBuffers(transport):
+    """
+    Asks for socket buffers large enough that a burst of segments is not dropped by the kernel before the
+    event loop gets to read it (the operating system may grant less)
+    """
+    sock = transport.get_extra_info('socket')
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER_SIZE)
+
+
+class DatagramChannel(asyncio.DatagramProtocol):
+    """
+    Channel for an RDTLayer over a UDP socket: send() packs the segment into a datagram for peer, receive()
+    returns the segments unpacked from the datagrams that arrived since the last call
+    """
+
+    def __init__(self, peer=None):
+        self.transport = None
+        self.peer = peer
+        self.inbox = []
+        self.countDatagramsSent = 0
+        self.countDatagramsReceived = 0
+        self.countMalformedDatagrams = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        enlargeBuffers(transport)
+
+    def datagram_received(self, data, addr):
+        self.countDatagramsReceived += 1
+        try:
+            self.inbox.append(Segment.unpack(data))
+        except ValueError:
+            self.countMalformedDatagrams += 1
+
+    def send(self, seg):
+        self.countDatagramsSent += 1
+        self.transport.sendto(seg.pack(), self.peer)
+
+    def receive(self):
+        inbox, self.inbox = self.inbox, []
+        return inbox
+
+
+class ImpairmentProxy(asyncio.DatagramProtocol):
+    """
+    Forwards datagrams between the client (whoever is not the server) and the server, impairing them on arrival
+    with the ratios and decisions of an UnreliableChannel per direction, which also keeps the counters:
+    a reordered datagram is held back until the next one in its direction has been forwarded, a delayed one is
+    forwarded delaySeconds later, a dropped one is discarded and a corrupted data segment gets an 'X' in its payload.
+    """
+
+    def __init__(self, serverAddress, toServer, toClient, delaySeconds, holdSeconds):
+        self.transport = None
+        self.serverAddress = serverAddress
+        self.clientAddress = None
+        self.toServer = toServer                        # UnreliableChannel making the client -> server decisions
+        self.toClient = toClient                        # UnreliableChannel making the server -> client decisions
+        self.delaySeconds = delaySeconds
+        self.holdSeconds = holdSeconds
+        self.held = {}                                  # Datagram held back for reordering, per direction
+
+    def connection_made(self, transport):
+        self.transport = transport
+        enlargeBuffers(transport)
+
+    def datagram_received(self, data, addr):
+        if addr == self.serverAddress:
+            channel, destination = self.toClient, self.clientAddress
+        else:
+            self.clientAddress = addr
+            channel, destination = self.toServer, self.serverAddress
+        if destination is None:
+            return
+
+        channel.currentIteration += 1
+        held = self.held.pop(channel, None)
+
+        if (held is None and channel.canDeliverOutOfOrder
+                and channel.decide(REORDER, UnreliableChannel.RATIO_OUT_OF_ORDER_PACKETS)):
+            channel.countOutOfOrderPackets += 1
+            self.held[channel] = (data, destination)
+            asyncio.get_running_loop().call_later(self.holdSeconds, self.releaseHeld, channel, data)
+            return
+
+        self.impair(channel, data, destination)
+        if held is not None:
+            self.transmit(channel, *held)
+
+    def releaseHeld(self, channel, data):
+        """
+        Forwards a held datagram that no other datagram overtook in time
+        """
+        held = self.held.get(channel)
+        if held is not None and held[0] is data:
+            del self.held[channel]
+            self.transmit(channel, *held)
+
+    def impair(self, channel, data, destination):
+        if channel.canDelayPackets and channel.decide(DELAY, UnreliableChannel.RATIO_DELAYED_PACKETS):
+            channel.countDelayedPackets += 1
+            asyncio.get_running_loop().call_later(self.delaySeconds, self.transmit, channel, data, destination)
+            return
+
+        dropped = channel.canDropPackets and channel.decide(DROP, UnreliableChannel.RATIO_DROPPED_PACKETS)
+        if dropped:
+            channel.countDroppedPackets += 1
+
+        seqnum = Segment.WIRE_HEADER.unpack_from(data)[1]
+        if seqnum != -1:
+            channel.countTotalDataPackets += 1
+
+            # only data packets can have checksum errors, the checksum on the wire is left as it was
+            if channel.canHaveChecksumErrors:
+                seg = Segment.unpack(data)
+                index = channel.corruptionIndex(seg)
+                if index is not None:
+                    seg.createChecksumError(index)
+                    channel.countChecksumErrorPackets += 1
+                    data = seg.pack()
+        else:
+            channel.countAckPackets += 1
+
+        if not dropped:
+            self.transmit(channel, data, destination)
+
+    def transmit(self, channel, data, destination):
+        # Delayed datagrams can come due after the transfer has finished
+        if self.transport.is_closing():
+            return
+        channel.countSentPackets += 1
+        self.transport.sendto(data, destination)
+
+
+class UdpTransferResult(object):
+    """
+    Outcome of a transfer over UDP
+    """
+
+    def __init__(self, completed, payloadBytes, elapsed, client, toServer, toClient, tick):
+        self.completed = completed
+        self.payloadBytes = payloadBytes
+        self.elapsedMs = elapsed * 1e3
+        self.megabytesPerSecond = payloadBytes / elapsed / 1e6 if completed else 0.0
+        self.smoothedRttMs = None if client.smoothedRtt is None else client.smoothedRtt * tick * 1e3
+        self.countSegmentTimeouts = client.countSegmentTimeouts
+        self.countFastRetransmits = client.countFastRetransmits
+        self.toServer = channelCounters(toServer)
+        self.toClient = channelCounters(toClient)
+
+    def toDict(self):
+        return dict(vars(self))
+
+    def toJson(self):
+        return json.dumps(self.toDict())
+
+
+def channelCounters(channel):
+    return {
+        'countSentPackets': channel.countSentPackets,
+        'countTotalDataPackets': channel.countTotalDataPackets,
+        'countAckPackets': channel.countAckPackets,
+        'countOutOfOrderPackets': channel.countOutOfOrderPackets,
+        'countDelayedPackets': channel.countDelayedPackets,
+        'countDroppedPackets': channel.countDroppedPackets,
+        'countChecksumErrorPackets': channel.countChecksumErrorPackets,
+    }
+
+
+async def runUdpTransfer(dataToSend, outOfOrder=False, dropPackets=False, delayPackets=False, dataErrors=False,
+                         seed=None, tick=DEFAULT_TICK, timeout=DEFAULT_TIMEOUT, dataLength=DEFAULT_DATA_LENGTH,
+                         flowControlWinSize=DEFAULT_WIN_SIZE, congestionControl=False, selectiveAck=False,
+                         fastRetransmit=False, quiet=True):
+    """
+    Transfers dataToSend (str or bytes) from a client RDTLayer to a server RDTLayer over UDP through an
+    ImpairmentProxy and returns a UdpTransferResult. The client always uses the RTT based retransmission timer,
+    the server's per-iteration timeout reports make no sense when iterations are wall-clock ticks.
+    quiet=False prints the events of both layers.
+    """
+    loop = asyncio.get_running_loop()
+    channelSeeds = [None, None]
+    if seed is not None:
+        seeds = random.Random(seed)
+        channelSeeds = [seeds.getrandbits(64), seeds.getrandbits(64)]
+    toServer = UnreliableChannel(outOfOrder, dropPackets, delayPackets, dataErrors, channelSeeds[0])
+    toClient = UnreliableChannel(outOfOrder, dropPackets, delayPackets, dataErrors, channelSeeds[1])
+
+    client = RDTLayer(dataLength, flowControlWinSize, congestionControl, selectiveAck, True, fastRetransmit)
+    server = RDTLayer(dataLength, flowControlWinSize, selectiveAck=selectiveAck)
+
+    serverChannel = DatagramChannel()
+    clientChannel = DatagramChannel()
+    transports = []
+    try:
+        transport, _ = await loop.create_datagram_endpoint(lambda: serverChannel, local_addr=('127.0.0.1', 0))
+        transports.append(transport)
+        serverAddress = transport.get_extra_info('sockname')
+
+        delaySeconds = UnreliableChannel.ITERATIONS_TO_DELAY_PACKETS * tick
+        proxy = ImpairmentProxy(serverAddress, toServer, toClient, delaySeconds, tick)
+        transport, _ = await loop.create_datagram_endpoint(lambda: proxy, local_addr=('127.0.0.1', 0))
+        transports.append(transport)
+        proxyAddress = transport.get_extra_info('sockname')
+
+        transport, _ = await loop.create_datagram_endpoint(lambda: clientChannel, local_addr=('127.0.0.1', 0))
+        transports.append(transport)
+
+        serverChannel.peer = proxyAddress
+        clientChannel.peer = proxyAddress
+
+        for layer, channel in ((client, clientChannel), (server, serverChannel)):
+            layer.setSendChannel(channel)
+            layer.setReceiveChannel(channel)
+            if not quiet:
+                layer.setTracer(ConsoleSink())
+        client.setDataToSend(dataToSend)
+
+        check = DeliveryCheck(dataToSend)
+        completed = False
+
+        start = loop.time()
+        clock = lambda: (loop.time() - start) / tick
+        client.setClock(clock)
+        server.setClock(clock)
+
+        while loop.time() - start < timeout:
+            client.processData()
+            server.processData()
+
+            if check.update(server.readDataReceived()):
+                completed = True
+                break
+
+            await asyncio.sleep(tick)
+
+        elapsed = loop.time() - start
+    finally:
+        for transport in transports:
+            transport.close()
+
+    return UdpTransferResult(completed, len(check.expected), elapsed, client, toServer, toClient, tick)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an RDT transfer over UDP on 127.0.0.1 and print the results as JSON')
+    parser.add_argument('--file', help='file whose bytes are sent (default: --size random bytes)')
+    parser.add_argument('--size', type=int, default=1 << 20, help='bytes of random data to send')
+    parser.add_argument('--out-of-order', action='store_true', help='proxy can deliver out of order')
+    parser.add_argument('--drop', action='store_true', help='proxy can drop datagrams')
+    parser.add_argument('--delay', action='store_true', help='proxy can delay datagrams')
+    parser.add_argument('--errors', action='store_true', help='proxy can corrupt datagrams')
+    parser.add_argument('--all', action='store_true', help='enable every impairment')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for the impairments')
+    parser.add_argument('--tick', type=float, default=DEFAULT_TICK * 1e3, help='milliseconds between ticks')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds before giving up')
+    parser.add_argument('--mss', type=int, default=DEFAULT_DATA_LENGTH, help='bytes per segment')
+    parser.add_argument('--window', type=int, default=DEFAULT_WIN_SIZE, help='flow-control window in bytes')
+    parser.add_argument('--congestion-control', action='store_true', help='enable slow start / AIMD in the sender')
+    parser.add_argument('--sack', action='store_true', help='enable selective acknowledgements')
+    parser.add_argument('--fast-retransmit', action='store_true', help='retransmit after three duplicate acks')
+    args = parser.parse_args()
+
+    if args.file is not None:
+        with open(args.file, 'rb') as f:
+            dataToSend = f.read()
+    else:
+        dataToSend = os.urandom(args.size)
+
+    result = asyncio.run(runUdpTransfer(dataToSend,
+                                        outOfOrder=args.out_of_order or args.all,
+                                        dropPackets=args.drop or args.all,
+                                        delayPackets=args.delay or args.all,
+                                        dataErrors=args.errors or args.all,
+                                        seed=args.seed,
+                                        tick=args.tick / 1e3,
+                                        timeout=args.timeout,
+                                        dataLength=args.mss,
+                                        flowControlWinSize=args.window,
+                                        congestionControl=args.congestion_control,
+                                        selectiveAck=args.sack,
+                                        fastRetransmit=args.fast_retransmit))
+    print(result.toJson())
+
+
+if __name__ == '__main__':
+    main()
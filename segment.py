@@ -1,5 +1,6 @@
 import random
-from functools import reduce
+import struct
+import zlib
 
 
 # #################################################################################################################### #
@@ -18,6 +19,20 @@ from functools import reduce
 
 class Segment():
 
+    # No per-instance __dict__, keeps in-flight segments small
+    __slots__ = ('seqnum', 'acknum', 'payload', 'checksum', 'startIteration', 'startDelayIteration', 'sackBlocks',
+                 'connectionId')
+
+    # Sequence and acknowledgement numbers as they enter the checksum
+    CHECKSUM_HEADER = struct.Struct('!qq')
+
+    # Connection id as it enters the checksum
+    CONNECTION_HEADER = struct.Struct('!I')
+
+    # Wire format: connectionId, seqnum, acknum, checksum, startIteration, payload length, number of sack blocks,
+    # followed by the sack blocks (CHECKSUM_HEADER each) and the payload bytes
+    WIRE_HEADER = struct.Struct('!IqqIiIH')
+
     def __init__(self):
         self.seqnum = -1
         self.acknum = -1
@@ -25,22 +40,34 @@ class Segment():
         self.checksum = 0
         self.startIteration = 0
         self.startDelayIteration = 0
+        self.sackBlocks = ()
+        self.connectionId = 0                           # Connection the segment belongs to when channels are shared
 
     def setData(self,seq,data):
         self.seqnum = seq
         self.acknum = -1
         self.payload = data
         self.checksum = 0
-        str = self.to_string()
-        self.checksum = self.calc_checksum(str)
+        self.sackBlocks = ()
+        self.checksum = self.calc_checksum()
+
+    # Data segment that also acknowledges data received from the other end (piggybacked ack)
+    def setDataAndAck(self,seq,data,ack,sackBlocks=()):
+        self.seqnum = seq
+        self.acknum = ack
+        self.payload = data
+        self.checksum = 0
+        self.sackBlocks = tuple(sackBlocks)
+        self.checksum = self.calc_checksum()
 
-    def setAck(self,ack):
+    # sackBlocks: (start, end) sequence number ranges received beyond the cumulative ack, end exclusive
+    def setAck(self,ack,sackBlocks=()):
         self.seqnum = -1
         self.acknum = ack
         self.payload = ''
         self.checksum = 0
-        str = self.to_string()
-        self.checksum = self.calc_checksum(str)
+        self.sackBlocks = tuple(sackBlocks)
+        self.checksum = self.calc_checksum()
 
     def setStartIteration(self,iteration):
         self.startIteration = iteration
@@ -55,22 +82,81 @@ class Segment():
         return self.startDelayIteration
 
     def to_string(self):
+        payload = self.payload
+        if not isinstance(payload, str):
+            payload = bytes(payload).decode('utf-8', 'replace')
+        if self.sackBlocks:
+            return "seq: {0}, ack: {1}, data: {2}, sack: {3}"\
+            .format(self.seqnum,self.acknum,payload,list(self.sackBlocks))
         return "seq: {0}, ack: {1}, data: {2}"\
-        .format(self.seqnum,self.acknum,self.payload)
+        .format(self.seqnum,self.acknum,payload)
+
+    # Binary wire representation, see WIRE_HEADER
+    def pack(self):
+        payload = self.payload
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8', 'surrogatepass')
+        parts = [Segment.WIRE_HEADER.pack(self.connectionId,self.seqnum,self.acknum,self.checksum,
+                                          self.startIteration,len(payload),len(self.sackBlocks))]
+        for start, end in self.sackBlocks:
+            parts.append(Segment.CHECKSUM_HEADER.pack(start,end))
+        parts.append(payload)
+        return b''.join(parts)
+
+    # Builds a segment from pack() output, the payload is a memoryview into data (no copy)
+    @classmethod
+    def unpack(cls,data):
+        view = memoryview(data)
+        connectionId, seqnum, acknum, checksum, startIteration, length, sackCount = Segment.WIRE_HEADER.unpack_from(view)
+        offset = Segment.WIRE_HEADER.size
+        sackBlocks = []
+        for _ in range(sackCount):
+            sackBlocks.append(Segment.CHECKSUM_HEADER.unpack_from(view,offset))
+            offset += Segment.CHECKSUM_HEADER.size
+        if offset + length > len(view):
+            raise ValueError("truncated segment: expected {0} payload bytes, got {1}".format(length,len(view) - offset))
+
+        segment = cls()
+        segment.connectionId = connectionId
+        segment.seqnum = seqnum
+        segment.acknum = acknum
+        segment.checksum = checksum
+        segment.startIteration = startIteration
+        segment.sackBlocks = tuple(sackBlocks)
+        segment.payload = view[offset:offset + length]
+        return segment
 
     def checkChecksum(self):
-        cs = self.calc_checksum(self.to_string())
+        cs = self.calc_checksum()
         return cs == self.checksum
 
-    def calc_checksum(self,str):
-        return reduce(lambda x,y:x+y, map(ord, str))
+    # CRC32 over the binary header (seq, ack, connection id, sack blocks) followed by the payload bytes
+    def calc_checksum(self):
+        checksum = zlib.crc32(Segment.CHECKSUM_HEADER.pack(self.seqnum,self.acknum))
+        checksum = zlib.crc32(Segment.CONNECTION_HEADER.pack(self.connectionId), checksum)
+        for start, end in self.sackBlocks:
+            checksum = zlib.crc32(Segment.CHECKSUM_HEADER.pack(start,end), checksum)
+        payload = self.payload
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8', 'surrogatepass')
+        return zlib.crc32(payload, checksum)
 
     def printToConsole(self):
         print(self.to_string())
 
     # Function to cause an error - Do not modify
-    def createChecksumError(self):
+    # (bytes-like payloads get the same treatment on a copy, the sender's buffer is never touched)
+    def createChecksumError(self, index=None):
+        # index picks the character to corrupt, channels pass one drawn from their own random generator
         if not self.payload:
             return
-        char = random.choice(self.payload)
-        self.payload = self.payload.replace(char, 'X', 1)
\ No newline at end of file
+        if index is None:
+            index = random.randrange(len(self.payload))
+        if isinstance(self.payload, str):
+            char = self.payload[index]
+            self.payload = self.payload.replace(char, 'X', 1)
+        else:
+            payload = bytes(self.payload)
+            char = payload[index]
+            index = payload.index(char)
+            self.payload = payload[:index] + b'X' + payload[index + 1:]
\ No newline at end of file
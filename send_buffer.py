@@ -0,0 +1,134 @@
+from collections import deque
+
+
+# #################################################################################################################### #
+# SendBuffer                                                                                                           #
+#                                                                                                                      #
+# Description:                                                                                                         #
+# Holds the data an RDTLayer is sending. In-memory sources (str, bytes, bytearray, memoryview, mmap) are served as     #
+# views of the original buffer. Streaming sources (file objects, iterators of str/bytes chunks) are read on demand in  #
+# fixed size blocks, and blocks are dropped again once everything in them has been acknowledged, so only a bounded     #
+# window of unacknowledged data is ever held in memory.                                                                #
+#                                                                                                                      #
+# Offsets are 0-based byte offsets into the whole stream.                                                              #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+class SendBuffer(object):
+    BLOCK_SIZE = 64 * 1024                              # Default size of a block read from a streaming source (in bytes)
+    CAPACITY = 16 * 1024 * 1024                         # Default limit on unacknowledged streaming data held (in bytes)
+
+    def __init__(self, source, alignment=1, blockSize=None, capacity=None):
+        """
+        alignment is the segment size: blocks are a multiple of it so segments never straddle two blocks
+        """
+        blockSize = SendBuffer.BLOCK_SIZE if blockSize is None else blockSize
+        self.blockSize = max(alignment, blockSize // alignment * alignment)
+        self.capacity = max(self.blockSize, SendBuffer.CAPACITY if capacity is None else capacity)
+
+        self.blocks = deque()                           # Blocks held, the first one starts at baseOffset
+        self.baseOffset = 0                             # Offset of the first byte still held
+        self.pulledEnd = 0                              # Offset just past the last byte read from the source
+        self.pending = bytearray()                      # Data read from the source that does not yet fill a block
+        self.length = None                              # Total length, known once the source is exhausted
+        self.reader = None                              # Returns the next chunk from a streaming source, b'' at the end
+
+        if isinstance(source, str):
+            source = source.encode('utf-8')
+
+        try:
+            whole = memoryview(source).cast('B')
+        except TypeError:
+            whole = None
+
+        if whole is not None:
+            # Already in memory: a single block spanning everything, served without copies
+            self.blocks.append(whole)
+            self.blockSize = max(len(whole), 1)
+            self.pulledEnd = self.length = len(whole)
+        elif hasattr(source, 'read'):
+            self.reader = lambda: source.read(self.blockSize)
+        else:
+            chunks = iter(source)
+            self.reader = lambda: next(chunks, b'')
+
+    def fill(self, end):
+        """
+        Reads from the source until data up to end is held, the source is exhausted or the capacity is
+        reached. Returns the offset data is available up to, at most end.
+        """
+        while self.pulledEnd < end and self.length is None and self.pulledEnd - self.baseOffset < self.capacity:
+            self.pullBlock()
+        return min(end, self.pulledEnd)
+
+    def pullBlock(self):
+        """
+        Reads from the source until one more block is complete or the source is exhausted
+        """
+        while len(self.pending) < self.blockSize:
+            chunk = self.reader()
+            if not chunk:
+                # Exhausted: whatever is left forms the final, shorter block
+                if self.pending:
+                    self.appendBlock(bytes(self.pending))
+                    self.pending.clear()
+                self.length = self.pulledEnd
+                return
+
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+
+            # A full block read in one go is kept as it is
+            if not self.pending and len(chunk) == self.blockSize:
+                self.appendBlock(chunk)
+                return
+            self.pending += chunk
+
+        self.appendBlock(bytes(self.pending[:self.blockSize]))
+        del self.pending[:self.blockSize]
+
+    def appendBlock(self, block):
+        self.blocks.append(memoryview(block))
+        self.pulledEnd += len(block)
+
+    def view(self, start, end):
+        """
+        Data from start to end, which must already have been filled and not released
+        """
+        index, blockOffset = divmod(start - self.baseOffset, self.blockSize)
+        block = self.blocks[index]
+        if blockOffset + (end - start) <= len(block):
+            return block[blockOffset:blockOffset + end - start]
+
+        # Only possible for callers that do not respect the alignment
+        parts = []
+        while start < end:
+            index, blockOffset = divmod(start - self.baseOffset, self.blockSize)
+            part = self.blocks[index][blockOffset:blockOffset + end - start]
+            parts.append(part)
+            start += len(part)
+        return b''.join(parts)
+
+    def release(self, offset):
+        """
+        Drops the blocks that lie entirely before offset, they are not needed any more
+        """
+        if self.reader is None:
+            return
+        while self.blocks and self.baseOffset + len(self.blocks[0]) <= offset:
+            self.baseOffset += len(self.blocks.popleft())
+
+    def isEnd(self, offset):
+        """
+        Checks whether offset is the end of the data
+        """
+        return self.length is not None and offset >= self.length
+
+    def bufferedBytes(self):
+        """
+        Number of bytes currently held in memory for a streaming source
+        """
+        if self.reader is None:
+            return 0
+        return self.pulledEnd - self.baseOffset + len(self.pending)
@@ -0,0 +1,155 @@
+import unittest
+
+from rdt_arq import GoBackN, SelectiveRepeat, StopAndWait
+from rdt_layer import RDTLayer
+from rdt_sim import runTransfer
+from segment import Segment
+from unreliable import UnreliableChannel
+
+
+# #################################################################################################################### #
+# RDTLayer regression tests                                                                                            #
+#                                                                                                                      #
+# Usage:                                                                                                               #
+#   python -m unittest test_rdt_layer                                                                                  #
+#                                                                                                                      #
+# #################################################################################################################### #
+
+
+def reliableChannel():
+    return UnreliableChannel(False, False, False, False)
+
+
+class PiggybackedAckTest(unittest.TestCase):
+
+    def setUp(self):
+        self.layer = RDTLayer(dataLength=4, flowControlWinSize=16)
+        self.layer.setSendChannel(reliableChannel())
+        self.layer.setReceiveChannel(reliableChannel())
+        self.layer.setDataToSend('abcdefghijklmnopqrstuvwxyz' * 3)
+
+    def receive(self, seqnum, data):
+        segment = Segment()
+        segment.setData(seqnum, data)
+        self.layer.receiveChannel.receiveQueue.append(segment)
+
+    def step(self):
+        """
+        Runs one iteration of the layer and returns the segments it sent
+        """
+        self.layer.processData()
+        segments, self.layer.sendChannel.sendQueue = self.layer.sendChannel.sendQueue, []
+        return segments
+
+    def testOutOfOrderArrivalFlagsOneSegment(self):
+        # Data from a peer that was not expected to send any is acked on the data sent in the next iteration
+        self.receive(5, b'efgh')
+        self.step()
+
+        segments = self.step()
+        self.assertEqual(len(segments), 4)
+        self.assertTrue(all(segment.acknum == 1 for segment in segments))
+        self.assertEqual(sum(segment.startIteration for segment in segments), 1)
+
+    def testDuplicateReportedOnce(self):
+        # Once the peer sends data, its segments are taken in first and acked on the same iteration's data
+        self.layer.selectiveAck = True
+        self.receive(1, b'abcd')
+        self.step()
+        self.receive(1, b'abcd')
+
+        segments = self.step()
+        self.assertEqual(sum(segment.startIteration for segment in segments), 1)
+        self.assertEqual([segment.sackBlocks for segment in segments if segment.sackBlocks], [((1, 5),)])
+
+    def testAckRidesOnSameIteration(self):
+        self.layer.setExpectPeerData(True)
+        self.receive(1, b'abcd')
+
+        segments = self.step()
+        self.assertEqual([segment.acknum for segment in segments], [5] * 4)
+
+    def testOneWaySenderSendsNoAcks(self):
+        # Nothing arrives from the server, which only acks
+        for _ in range(5):
+            self.assertTrue(all(segment.seqnum != -1 for segment in self.step()))
+
+
+class ReadDataReceivedTest(unittest.TestCase):
+
+    def testReadReleasesDecodedText(self):
+        layer = RDTLayer()
+        layer.deliverInOrder(b'ab')
+        self.assertEqual(layer.getDataReceived(), 'ab')
+
+        self.assertEqual(layer.readDataReceived(), b'ab')
+        layer.deliverInOrder(b'cd')
+        self.assertEqual(layer.getDataReceived(), 'cd')
+        self.assertEqual(layer.getBytesReceived(), b'cd')
+
+
+class SegmentTimeoutCountTest(unittest.TestCase):
+
+    def testLosslessTransferHasNoTimerExpiries(self):
+        self.assertEqual(runTransfer('x' * 1000, adaptiveTimeout=True).countSegmentTimeouts, 0)
+        self.assertEqual(runTransfer('x' * 1000, arq=GoBackN).countSegmentTimeouts, 0)
+
+
+class ArqStrategyTest(unittest.TestCase):
+
+    def testCompletesUnderEachImpairment(self):
+        impairments = ('outOfOrder', 'dropPackets', 'delayPackets', 'dataErrors')
+        for arq in (StopAndWait, GoBackN, SelectiveRepeat):
+            for impairment in impairments:
+                for seed in range(5):
+                    result = runTransfer('abcdefghijklmnopqrstuvwxyz' * 8, seed=seed, maxIterations=2000, arq=arq,
+                                         **{impairment: True})
+                    self.assertTrue(result.completed, '%s %s seed %d' % (arq.__name__, impairment, seed))
+
+    def testSelectiveRepeatResendsExpiredSegmentsOnly(self):
+        layer = RDTLayer(dataLength=4, flowControlWinSize=16)
+        layer.setSendChannel(reliableChannel())
+        layer.setReceiveChannel(reliableChannel())
+        layer.setDataToSend('abcdefghijklmnop')
+        layer.setArqStrategy(SelectiveRepeat(timeout=3))
+
+        layer.processData()
+        self.assertEqual([segment.seqnum for segment in layer.sendChannel.sendQueue], [1, 5, 9, 13])
+        layer.sendChannel.sendQueue = []
+
+        # Every segment but the first one is acknowledged
+        ack = Segment()
+        ack.setAck(1, ((5, 9), (9, 13), (13, 17)))
+        layer.receiveChannel.receiveQueue.append(ack)
+        layer.processData()
+        layer.processData()
+        self.assertEqual(layer.sendChannel.sendQueue, [])
+
+        layer.processData()
+        self.assertEqual([segment.seqnum for segment in layer.sendChannel.sendQueue], [1])
+        self.assertEqual(layer.countRetransmittedSegments, 1)
+
+    def testBuiltinOptionsRefused(self):
+        for option in RDTLayer.BUILTIN_OPTIONS:
+            layer = RDTLayer(**{option: True})
+            with self.assertRaises(ValueError):
+                layer.setArqStrategy(GoBackN())
+            self.assertIsNone(layer.arq)
+
+
+class BidirectionalTransferTest(unittest.TestCase):
+
+    def testFirstSegmentsLost(self):
+        # Seed 0 drops the client's only segment: the server has received nothing it would ack, yet it must make
+        # the client retransmit
+        result = runTransfer('abcd', dropPackets=True, seed=0, serverDataToSend='wxyz', maxIterations=1000)
+        self.assertTrue(result.completed)
+
+    def testShortTransfersComplete(self):
+        for seed in range(50):
+            result = runTransfer('abcd', True, True, True, True, seed=seed, serverDataToSend='wxyz', maxIterations=1000)
+            self.assertTrue(result.completed, 'seed %d' % seed)
+
+
+if __name__ == '__main__':
+    unittest.main()
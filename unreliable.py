@@ -1,5 +1,10 @@
+import heapq
+import itertools
 import random
 
+import rdt_events
+from channel_trace import CORRUPT, DELAY, DROP, REORDER
+
 
 # #################################################################################################################### #
 # UnreliableChannel                                                                                                    #
@@ -23,10 +28,18 @@ class UnreliableChannel():
     RATIO_OUT_OF_ORDER_PACKETS = 0.1
     ITERATIONS_TO_DELAY_PACKETS = 5
 
-    def __init__(self, canDeliverOutOfOrder_, canDropPackets_, canDelayPackets_, canHaveChecksumErrors_):
+    def __init__(self, canDeliverOutOfOrder_, canDropPackets_, canDelayPackets_, canHaveChecksumErrors_,
+                 seed=None, recorder=None, replay=None):
+        # Without a seed the channel draws from the shared module level generator
+        self.seed = seed
+        self.random = random if seed is None else random.Random(seed)
+        self.recorder = recorder                        # ChannelRecorder that logs every impairment decision
+        self.replay = replay                            # ChannelReplay whose decisions are applied instead of random draws
+        self.tracer = None                              # TraceSink receiving drop/delay/corrupt events (see rdt_events)
         self.sendQueue = []
         self.receiveQueue = []
-        self.delayedPackets = []
+        self.delayedPackets = []                        # Heap of (release iteration, order delayed, segment)
+        self.delayOrder = itertools.count()             # Keeps segments released in the same iteration in the order delayed
         self.canDeliverOutOfOrder = canDeliverOutOfOrder_
         self.canDropPackets = canDropPackets_
         self.canDelayPackets = canDelayPackets_
@@ -41,12 +54,30 @@ class UnreliableChannel():
         self.countAckPackets = 0
         self.currentIteration = 0
 
+    def setTracer(self, tracer):
+        self.tracer = tracer
+
+    def getMetrics(self):
+        """
+        The cumulative counters and the current queue lengths (see rdt_metrics)
+        """
+        return {
+            'dataPackets': self.countTotalDataPackets,
+            'ackPackets': self.countAckPackets,
+            'sentPackets': self.countSentPackets,
+            'droppedPackets': self.countDroppedPackets,
+            'delayedPackets': self.countDelayedPackets,
+            'checksumErrorPackets': self.countChecksumErrorPackets,
+            'outOfOrderPackets': self.countOutOfOrderPackets,
+            'queuedPackets': len(self.sendQueue),
+            'heldPackets': len(self.delayedPackets),
+        }
+
     def send(self,seg):
         self.sendQueue.append(seg)
 
     def receive(self):
-        new_list = list(self.receiveQueue)
-        self.receiveQueue.clear()
+        new_list, self.receiveQueue = self.receiveQueue, []
         #print("UnreliableChannel len receiveQueue: {0}".format(len(self.receiveQueue)))
         return new_list
 
@@ -57,58 +88,60 @@ class UnreliableChannel():
         if len(self.sendQueue) == 0:
             return
 
+        # take the queued segments, new sends go to a fresh list
+        sendQueue, self.sendQueue = self.sendQueue, []
+
         if self.canDeliverOutOfOrder:
-            val = random.random()
-            if val <= UnreliableChannel.RATIO_OUT_OF_ORDER_PACKETS:
+            if self.decide(REORDER, UnreliableChannel.RATIO_OUT_OF_ORDER_PACKETS):
                 self.countOutOfOrderPackets += 1
-                self.sendQueue.reverse()
+                sendQueue = reversed(sendQueue)
 
-        # add in delayed packets
-        noLongerDelayed = []
-        for seg in self.delayedPackets:
-            numIterDelayed = self.currentIteration - seg.getStartDelayIteration()
-            if (numIterDelayed) >= UnreliableChannel.ITERATIONS_TO_DELAY_PACKETS:
-                noLongerDelayed.append(seg)
-
-        for seg in noLongerDelayed:
+        # add in delayed packets, the heap yields them in the order they were delayed
+        while self.delayedPackets and self.delayedPackets[0][0] <= self.currentIteration:
+            seg = heapq.heappop(self.delayedPackets)[2]
             self.countSentPackets += 1
-            self.delayedPackets.remove(seg)
-            self.receiveQueue.append(seg)
+            self.deliver(seg)
 
-        for seg in self.sendQueue:
+        for seg in sendQueue:
             #self.receiveQueue.append(seg)
 
             addToReceiveQueue = False
             if self.canDelayPackets:
-                val = random.random()
-                if val <= UnreliableChannel.RATIO_DELAYED_PACKETS:
+                if self.decide(DELAY, UnreliableChannel.RATIO_DELAYED_PACKETS):
                     self.countDelayedPackets += 1
                     seg.setStartDelayIteration(self.currentIteration)
-                    self.delayedPackets.append(seg)
+                    releaseIteration = self.currentIteration + UnreliableChannel.ITERATIONS_TO_DELAY_PACKETS
+                    heapq.heappush(self.delayedPackets, (releaseIteration, next(self.delayOrder), seg))
+                    if self.tracer is not None:
+                        self.tracer.emitSegment(rdt_events.DELAY, self.currentIteration, seg)
                     continue
 
             if self.canDropPackets:
-                val = random.random()
-                if val <= UnreliableChannel.RATIO_DROPPED_PACKETS:
+                if self.decide(DROP, UnreliableChannel.RATIO_DROPPED_PACKETS):
                     self.countDroppedPackets += 1
+                    if self.tracer is not None:
+                        self.tracer.emitSegment(rdt_events.DROP, self.currentIteration, seg)
                 else:
                     addToReceiveQueue = True
             else:
                 addToReceiveQueue = True
 
             if addToReceiveQueue:
-                self.receiveQueue.append(seg)
+                self.deliver(seg)
                 self.countSentPackets += 1
 
-            if seg.acknum == -1:
+            # data segments may carry a piggybacked ack, only pure acks have no sequence number
+            if seg.seqnum != -1:
                 self.countTotalDataPackets += 1
 
                 # only data packets can have checksum errors...
                 if self.canHaveChecksumErrors:
-                    val = random.random()
-                    if val <= UnreliableChannel.RATIO_DATA_ERROR_PACKETS:
-                        seg.createChecksumError()
+                    index = self.corruptionIndex(seg)
+                    if index is not None:
+                        seg.createChecksumError(index)
                         self.countChecksumErrorPackets += 1
+                        if self.tracer is not None:
+                            self.tracer.emitSegment(rdt_events.CORRUPT, self.currentIteration, seg)
 
             else:
                 # count ack packets...
@@ -116,5 +149,47 @@ class UnreliableChannel():
 
             #print("UnreliableChannel len receiveQueue: {0}".format(len(self.receiveQueue)))
 
-        self.sendQueue.clear()
         #print("UnreliableChannel manage - len receiveQueue: {0}".format(len(self.receiveQueue)))
+
+    def deliver(self, seg):
+        """
+        Hands a segment that made it through the channel to the receiving side
+        """
+        self.receiveQueue.append(seg)
+
+    def deliverMany(self, segments):
+        """
+        Hands several segments that made it through the channel to the receiving side at once, in order
+        """
+        self.receiveQueue.extend(segments)
+
+    def decide(self, kind, ratio):
+        """
+        Whether the impairment of the given kind hits: a draw against ratio, or the next decision of a replayed trace
+        """
+        hit = None if self.replay is None else self.replay.next(kind)
+        # Without a trace, or once it holds no more decisions of this kind, draw
+        if hit is None:
+            hit = self.random.random() <= ratio
+
+        if self.recorder is not None:
+            self.recorder.record(kind, hit)
+        return hit
+
+    def corruptionIndex(self, seg):
+        """
+        Index of the payload character to corrupt, or None when the segment is not corrupted
+        """
+        index = None if self.replay is None else self.replay.nextCorruption()
+        if index is None:
+            if self.random.random() <= UnreliableChannel.RATIO_DATA_ERROR_PACKETS:
+                index = self.random.randrange(len(seg.payload)) if seg.payload else 0
+            else:
+                index = -1
+        elif index >= 0 and seg.payload:
+            # The trace may have been recorded with longer segments
+            index %= len(seg.payload)
+
+        if self.recorder is not None:
+            self.recorder.record(CORRUPT, index >= 0, index)
+        return index if index >= 0 else None